@@ -6,27 +6,105 @@ import argparse
 from pathlib import Path
 from datetime import datetime
 from PIL import Image, UnidentifiedImageError
-import imagehash
+import PIL.features
+import numpy as np
 import exifread
 import sys
 import concurrent.futures
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+import queue
 import signal
 import contextlib
-import threading # 引入 threading 模块用于锁
 import re # Import the re module for regular expressions
+import io
+import mmap
+import struct
+import errno
+import itertools
+import threading
+import time
+import multiprocessing
+import sqlite3
+from collections import namedtuple, Counter
+from dataclasses import dataclass, field, replace
+
+try:
+    import blake3 # 可选依赖：SIMD 加速的 BLAKE3 哈希
+except ImportError:
+    blake3 = None
+try:
+    import xxhash # 可选依赖：非加密的 xxh3 哈希
+except ImportError:
+    xxhash = None
+try:
+    import fcntl # 仅 Unix：用于 FICLONE (reflink) ioctl
+except ImportError:
+    fcntl = None
 
 # ===== 默认配置（可被参数覆盖）=====
 
 HASH_ALGO = 'sha256'
+HASH_ALGOS = ('sha256', 'blake3', 'xxh3') # 查重只需要区分内容，blake3/xxh3 比 sha256 快得多
 HASH_THRESHOLD = 5
+# 不小于该大小的文件 (RAW、视频) 用 BLAKE3 哈希时启用多线程；小文件的线程调度开销大于收益
+BLAKE3_MT_MIN_BYTES = 16 * 1024 * 1024
+# 小于该大小的文件计算完整哈希时直接 read，更大的才 mmap (实测 16 KB~256 KB 时 read 快 5~30%，1 MB 起两者持平，再大 mmap 更快)
+HASH_MMAP_MIN_BYTES = 256 * 1024
+HASH_READ_BYTES = 256 * 1024 # 无法 mmap 且没有 hashlib.file_digest (Python 3.11 之前) 时每次 readinto 的块大小，与 file_digest 相同
+HEAD_HASH_BYTES = 64 * 1024 # 同大小文件先比较开头 64 KB 的哈希 (越过相机/软件写入的相同文件头)
 # Keep default for fallback/pattern matching, but will generate numbered files
 DEFAULT_LOG_FILE = "photo_dedup.log"
+# 静态图片扩展名 (可计算感知哈希/读取分辨率)；frozenset 便于扫描时 O(1) 查找
+STILL_IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'})
 # 添加常见视频格式，但请注意相似度判断仅对图片有效
-IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.mp4', '.avi', '.mov', '.mkv']
+IMAGE_EXTENSIONS = STILL_IMAGE_EXTENSIONS | {'.mp4', '.avi', '.mov', '.mkv'}
+# 图片文件头魔数 (JPEG, PNG, GIF, BMP, TIFF 小端/大端)；WebP 需额外检查偏移 8 处的 'WEBP'
+IMAGE_MAGIC_PREFIXES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a', b'BM', b'II*\x00', b'MM\x00*')
+IMAGE_MAGIC_BYTES = 12 # 最长的检查是 WebP 的 'RIFF' + 4 字节长度 + 'WEBP'
 DEFAULT_MIN_SIZE_KB = 100 # 默认最小文件大小为 100 KB
 GPS_THRESHOLD = 0.0001
+# JPEG 的 EXIF (APP1) 位于文件开头，读取 GPS 时只需读取文件前缀
+EXIF_PREFIX_BYTES = 128 * 1024
+GPS_IFD_TAG = 0x8825 # EXIF GPSInfo 子 IFD
 LOG_FILE_SIZE_LIMIT_MB = 10
+# 计算 phash 前让 JPEG 解码器按此尺寸降采样 (phash 内部缩放到 32x32，留出余量)；
+# libjpeg 最多缩小到 1/8，千万像素级照片已是这一档，剩余耗时主要是熵解码，调小此值只会改变小图的哈希
+PHASH_DRAFT_SIZE = 64
+FEATURE_CACHE_FILE = 'dedup_cache.db' # 特征缓存数据库，保存在备份目录下
+FEATURE_BATCH_SIZE = 32 # 预计算时每个子进程任务处理的文件数，减少进程间通信次数
+# 决策循环每积累这么多个备份操作才向 I/O 线程池提交一个任务：每个 Future 的提交和线程唤醒约 7 us，
+# 逐个提交时在主线程中的开销比决策本身还大；批不宜过大，否则文件较少时 I/O 线程分不到任务
+IO_BATCH_SIZE = 16
+PROGRESS_INTERVAL = 0.1 # 进度条最短刷新间隔 (秒)，避免每个文件都格式化输出并 flush
+INTERRUPT_POLL_INTERVAL = 0.2 # 等待线程池/进程池结果时检查中断标志的间隔 (秒)
+
+@dataclass(frozen=True, slots=True)
+class DedupConfig:
+    """一次运行内不变的处理配置，在 __main__ 中由命令行参数构建一次，避免在热路径上重复读取 args 和构造 Path"""
+    perform_actions: bool
+    backup_dir: Path
+    trash_dir: Path | None
+    delete_soft: bool
+    enable_console_log: bool
+    simple_backup: bool
+    simple_backup_with_path: bool
+    overwrite_files: bool
+    deduplicate: bool
+    deduplicate_only: bool
+    include_similar: bool
+    prefer_resolution: bool
+    hash_threshold: int
+    min_size_bytes: int
+    hash_algo: str = HASH_ALGO
+    source_dirs: tuple = () # 本次处理的全部源目录 (按优先级排列)，由 process_directory 填入
+
+# Pillow 快速路径无法给出结论时的哨兵值，需回退到 exifread
+_GPS_FAST_PATH_MISS = object()
+# TIFF 头部字节序标记 -> struct 格式前缀
+_TIFF_BYTE_ORDERS = {b'II': '<', b'MM': '>'}
+
+# 扫描阶段缓存的文件信息，避免后续重复 stat() 系统调用
+FileInfo = namedtuple('FileInfo', ['path', 'size', 'mtime'])
 
 # ===== 全局中断标志 =====
 
@@ -59,33 +137,346 @@ signal.signal(signal.SIGINT, signal_handler)  # 捕获 Ctrl+C
 
 # ===== 工具函数 =====
 
+def _max_path_length():
+    """当前平台允许的最长路径 (字符数)：Windows 未启用长路径支持时受 MAX_PATH (260，含结尾的 NUL) 限制"""
+    if sys.platform != 'win32':
+        return 4096 - 1 # PATH_MAX
+    try:
+        import winreg
+        with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"SYSTEM\CurrentControlSet\Control\FileSystem") as key:
+            if winreg.QueryValueEx(key, "LongPathsEnabled")[0]:
+                return 32767
+    except OSError:
+        pass
+    return 260 - 1
+
+MAX_PATH_LENGTH = _max_path_length()
+
+def hash_algo_available(algo):
+    """检查哈希算法所需的可选依赖是否已安装"""
+    if algo == 'blake3':
+        return blake3 is not None
+    if algo == 'xxh3':
+        return xxhash is not None
+    return True
+
+def new_hasher(algo=HASH_ALGO, size=0):
+    """创建哈希对象；'blake3'/'xxh3' 需要安装 blake3/xxhash 包，未安装时回退到 sha256。
+    size 为待哈希的数据量，BLAKE3 对大文件启用内部多线程 (树形结构，各分块可并行计算)"""
+    if algo == 'blake3' and blake3 is not None:
+        if size >= BLAKE3_MT_MIN_BYTES:
+            return blake3.blake3(max_threads=blake3.blake3.AUTO)
+        return blake3.blake3()
+    if algo == 'xxh3' and xxhash is not None:
+        return xxhash.xxh3_128()
+    if not hash_algo_available(algo):
+        algo = 'sha256'
+    # hashlib.sha256 等具名构造函数直接对应 OpenSSL 实现 (OpenSSL 会自动使用 SHA-NI 指令)，比 hashlib.new 按名称查找快一倍
+    constructor = getattr(hashlib, algo, None)
+    return constructor() if constructor is not None else hashlib.new(algo)
+
+def cpu_has_sha_extensions():
+    """Linux 下通过 /proc/cpuinfo 判断 CPU 是否支持 SHA 指令扩展 (x86 的 sha_ni，ARM 的 sha2)；无法判断时返回 None"""
+    try:
+        with open('/proc/cpuinfo', encoding='ascii', errors='replace') as f:
+            for line in f:
+                if line.startswith(('flags', 'Features')):
+                    flags = line.split(':', 1)[1].split()
+                    return 'sha_ni' in flags or 'sha2' in flags
+    except OSError:
+        pass
+    return None
+
+# 顺序访问提示 (平台不支持时为 None)
+_MADV_SEQUENTIAL = getattr(mmap, 'MADV_SEQUENTIAL', None)
+_FADV_SEQUENTIAL = getattr(os, 'POSIX_FADV_SEQUENTIAL', None)
+_FADV_WILLNEED = getattr(os, 'POSIX_FADV_WILLNEED', None)
+# 每个工作进程/线程提前预读的文件数与每个文件的预读字节数 (照片能整个读入，大视频只预读开头，不挤占页缓存)
+PREFETCH_AHEAD = 2
+PREFETCH_BYTES = 16 * 1024 * 1024
+
+def prefetch_file(filepath):
+    """提示内核在后台把文件开头 PREFETCH_BYTES 读入页缓存 (posix_fadvise 立即返回)，失败时忽略"""
+    try:
+        fd = os.open(filepath, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            os.posix_fadvise(fd, 0, PREFETCH_BYTES, _FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+def iter_prefetched(paths):
+    """依次返回 paths 中的文件，同时对其后第 PREFETCH_AHEAD 个文件发出预读提示，
+    让磁盘读取与当前文件的哈希/解码重叠 (不支持 posix_fadvise 的平台上原样返回)"""
+    if _FADV_WILLNEED is None:
+        yield from paths
+        return
+    for filepath in paths[:PREFETCH_AHEAD]:
+        prefetch_file(filepath)
+    for i, filepath in enumerate(paths):
+        if i + PREFETCH_AHEAD < len(paths):
+            prefetch_file(paths[i + PREFETCH_AHEAD])
+        yield filepath
+
+# hashlib.file_digest 在 Python 3.11 才加入，之前的版本改用 readinto 循环
+_file_digest = getattr(hashlib, 'file_digest', None)
+
+def _hash_readinto(f, h):
+    """把文件对象的剩余内容分块读入同一个缓冲区并更新哈希 (不为每块分配新的 bytes)"""
+    buf = bytearray(HASH_READ_BYTES)
+    view = memoryview(buf)
+    while n := f.readinto(buf):
+        h.update(view[:n])
+
+def _read_fd(fd, n):
+    """从文件描述符读取最多 n 字节，直到读满或遇到 EOF (与 f.read(n) 相同)：
+    一次 read(2) 可能返回少于请求的字节数 (FUSE、SMB/NFS 或被信号打断时)，只读一次哈希可能只覆盖文件的一部分"""
+    data = os.read(fd, n)
+    while len(data) < n:
+        chunk = os.read(fd, n - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
 def file_hash(filepath, algo=HASH_ALGO):
-    """计算文件的哈希值"""
-    h = hashlib.new(algo)
+    """计算文件的哈希值 (mmap 整个文件，一次 update 交给 C 实现完成；
+    不支持 mmap 的文件系统上改用 hashlib.file_digest，同样在 C 中分块读取；Python 3.11 之前用 readinto 循环)"""
     try:
-        with open(filepath, 'rb') as f:
-            while chunk := f.read(8192):
-                h.update(chunk)
+        # 与 read_prefix 相同，直接使用文件描述符，不创建缓冲文件对象
+        fd = os.open(filepath, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            size = os.fstat(fd).st_size
+            h = new_hasher(algo, size)
+            if 0 < size < HASH_MMAP_MIN_BYTES:
+                # 小文件直接 read 比建立/撤销映射加缺页处理更快 (通常一次系统调用即可读满)
+                h.update(_read_fd(fd, size))
+            elif size > 0: # 空文件无法 mmap
+                try:
+                    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                        # 顺序读取整个文件：提示内核加大预读，并尽早回收已读过的页
+                        if _MADV_SEQUENTIAL is not None:
+                            mm.madvise(_MADV_SEQUENTIAL)
+                        h.update(mm)
+                except (OSError, ValueError):
+                    if _FADV_SEQUENTIAL is not None:
+                        os.posix_fadvise(fd, 0, 0, _FADV_SEQUENTIAL)
+                    with open(fd, 'rb', closefd=False) as f:
+                        if _file_digest is not None:
+                            h = _file_digest(f, lambda: new_hasher(algo, size))
+                        else:
+                            _hash_readinto(f, h)
+        finally:
+            os.close(fd)
         return h.hexdigest()
     except Exception as e:
         logging.error(f"❌ 计算文件哈希失败: {filepath}，原因: {e}")
         return None
 
+def file_hash_and_features(filepath, algo=HASH_ALGO):
+    """完整哈希与图片特征一起计算，返回 (哈希, 32x32 灰度像素或 None, 分辨率, GPS)：mmap 整个文件，
+    先哈希再直接从同一映射解码，文件只从磁盘读一遍 (用于之后一定还要计算感知哈希的文件)；
+    phash 由调用方对整块文件的像素一次计算 (见 _hash_chunk)"""
+    try:
+        with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # 不提示 MADV_SEQUENTIAL：哈希读过的页还要留给随后的解码
+            h = new_hasher(algo, len(mm))
+            h.update(mm)
+            digest = h.hexdigest()
+            pixels, resolution, gps = load_image_features(filepath, fp=mm)
+    except (OSError, ValueError):
+        # 空文件、不支持 mmap 的文件系统或读取失败：分别读取 (失败原因由各自记录)
+        digest = file_hash(filepath, algo)
+        pixels, resolution, gps = load_image_features(filepath)
+    return digest, pixels, resolution, gps
+
+def read_prefix(filepath, n):
+    """读取文件开头最多 n 字节；直接使用 os.open/os.read，不创建缓冲文件对象 (省去 fstat/isatty 系统调用)；
+    不超过 HEAD_HASH_BYTES 的文件的头部哈希就是完整哈希，必须读满 n 字节或读到 EOF (见 _read_fd)"""
+    fd = os.open(filepath, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        return _read_fd(fd, n)
+    finally:
+        os.close(fd)
+
+def file_head_hash(filepath, algo=HASH_ALGO):
+    """计算文件开头 HEAD_HASH_BYTES 字节的哈希值，用于在完整哈希前快速排除内容不同的同大小文件"""
+    h = new_hasher(algo)
+    try:
+        h.update(read_prefix(filepath, HEAD_HASH_BYTES))
+        return h.hexdigest()
+    except Exception as e:
+        logging.error(f"❌ 计算文件头部哈希失败: {filepath}，原因: {e}")
+        return None
+
+def _head_hash_batch(filepaths, algo=HASH_ALGO):
+    """在线程池中计算一批文件的头部哈希"""
+    return [file_head_hash(filepath, algo) for filepath in filepaths]
+
+def _dms_to_degrees(degrees, minutes, seconds):
+    """度、分、秒 (已转为 float) 合成为十进制度数"""
+    return degrees + minutes / 60.0 + seconds / 3600.0
+
 def to_decimal_degrees(dms):
     """将 EXIF 的 DMS (度分秒) 格式转换为十进制度数"""
-    degrees = float(dms[0].num) / float(dms[0].den)
-    minutes = float(dms[1].num) / float(dms[1].den)
-    seconds = float(dms[2].num) / float(dms[2].den)
-    return degrees + (minutes / 60.0) + (seconds / 3600.0)
+    d, m, s = dms
+    return _dms_to_degrees(d.num / d.den, m.num / m.den, s.num / s.den)
+
+def _jpeg_exif_segment(buf):
+    """在 JPEG 前缀中定位 EXIF (APP1) 段，返回 (TIFF 数据的 (起, 止) 偏移, 是否截断)；
+    偏移在 SOS 之前没有 EXIF 时为 None，段结构异常或 APP1 超出前缀时为 _GPS_FAST_PATH_MISS；
+    截断表示 APP1 没有完整包含在前缀中，需要读取完整文件 (段结构异常时交给 exifread 自行处理，不算截断)"""
+    pos = 2
+    while pos + 4 <= len(buf):
+        if buf[pos] != 0xFF:
+            return _GPS_FAST_PATH_MISS, False
+        marker = buf[pos + 1]
+        if marker in (0xD9, 0xDA): # EOI / SOS 之后不会再有 APP1
+            return None, False
+        length = int.from_bytes(buf[pos + 2:pos + 4], 'big')
+        if marker == 0xE1 and buf[pos + 4:pos + 10] == b'Exif\x00\x00':
+            end = pos + 2 + length
+            return ((pos + 10, end), False) if end <= len(buf) else (_GPS_FAST_PATH_MISS, True)
+        pos += 2 + length
+    # 在前缀内未遇到 APP1 的结束，说明还有段未读完
+    return _GPS_FAST_PATH_MISS, True
+
+def _jpeg_exif_truncated(buf):
+    """判断 JPEG 前缀中的 EXIF (APP1) 段是否被截断，需要读取完整文件"""
+    return _jpeg_exif_segment(buf)[1]
+
+def _tiff_ifd_entries(tiff, order, offset):
+    """读取 TIFF 中一个 IFD 的全部条目，返回 {标签: (类型, 数量, 4 字节值/偏移字段)}"""
+    count = struct.unpack_from(order + 'H', tiff, offset)[0]
+    start = offset + 2
+    return {tag: (typ, n, value) for tag, typ, n, value
+            in struct.iter_unpack(order + 'HHI4s', tiff[start:start + 12 * count])}
+
+def _tiff_dms(tiff, order, entry):
+    """将 GPS IFD 中 3 个 RATIONAL 组成的度分秒条目转换为十进制度数，格式不符时返回 None"""
+    typ, count, value = entry
+    if typ != 5 or count != 3: # 5 = RATIONAL
+        return None
+    offset = struct.unpack(order + 'I', value)[0]
+    d_num, d_den, m_num, m_den, s_num, s_den = struct.unpack_from(order + '6I', tiff, offset)
+    if not (d_den and m_den and s_den):
+        return None
+    return _dms_to_degrees(d_num / d_den, m_num / m_den, s_num / s_den)
 
-def get_gps_coordinates(filepath):
-    """从文件 EXIF 中提取 GPS 坐标"""
+def _gps_from_tiff(tiff):
+    """直接解析 EXIF 的 TIFF 结构，只读取 IFD0 的 GPSInfo 指针和 GPS IFD 的 1~4 号标签；
+    tiff 可以是 memoryview，不复制数据；结构不符合预期时返回 _GPS_FAST_PATH_MISS"""
+    try:
+        order = _TIFF_BYTE_ORDERS.get(bytes(tiff[:2]))
+        if order is None or struct.unpack_from(order + 'H', tiff, 2)[0] != 42:
+            return _GPS_FAST_PATH_MISS
+        ifd0 = _tiff_ifd_entries(tiff, order, struct.unpack_from(order + 'I', tiff, 4)[0])
+        pointer = ifd0.get(GPS_IFD_TAG)
+        if pointer is None:
+            return None
+        gps = _tiff_ifd_entries(tiff, order, struct.unpack(order + 'I', pointer[2])[0])
+        if not gps:
+            return None
+        if 2 not in gps or 4 not in gps:
+            return _GPS_FAST_PATH_MISS # 信息不完整，交给 exifread 路径记录警告
+        latitude = _tiff_dms(tiff, order, gps[2])
+        longitude = _tiff_dms(tiff, order, gps[4])
+        if latitude is None or longitude is None:
+            return _GPS_FAST_PATH_MISS
+        if 1 in gps and gps[1][2][:1] == b'S':
+            latitude = -latitude
+        if 3 in gps and gps[3][2][:1] == b'W':
+            longitude = -longitude
+        return latitude, longitude
+    except struct.error:
+        return _GPS_FAST_PATH_MISS
+
+def _gps_via_pillow(buf):
+    """使用 Pillow 的 EXIF 接口从 JPEG 前缀中提取 GPS，只解析 GPS IFD；无法处理时返回 _GPS_FAST_PATH_MISS"""
+    try:
+        with Image.open(io.BytesIO(buf)) as img:
+            return _gps_from_image(img)
+    except Exception:
+        return _GPS_FAST_PATH_MISS
+
+def _gps_from_image(img):
+    """从已打开的 JPEG 图片 (EXIF 在打开时已随 APP1 读入) 提取 GPS；其他格式或无法处理时返回 _GPS_FAST_PATH_MISS"""
+    if img.format != 'JPEG':
+        return _GPS_FAST_PATH_MISS # TIFF/PNG 等的 EXIF 可能需要额外读取，交给 get_gps_coordinates
+    exif = img.info.get('exif')
+    if not exif:
+        return None
+    if exif.startswith(b'Exif\x00\x00'):
+        # 直接解析打开时读入的原始 APP1 数据，省去 getexif() 构建全部标签
+        coords = _gps_from_tiff(memoryview(exif)[6:])
+        if coords is not _GPS_FAST_PATH_MISS:
+            return coords
     try:
-        with open(filepath, 'rb') as f:
+        gps = img.getexif().get_ifd(GPS_IFD_TAG)
+        if not gps:
+            return None
+        if 2 not in gps or 4 not in gps:
+            return _GPS_FAST_PATH_MISS # 信息不完整，交给 exifread 路径记录警告
+        lat_d, lat_m, lat_s = gps[2]
+        lon_d, lon_m, lon_s = gps[4]
+        latitude = _dms_to_degrees(float(lat_d), float(lat_m), float(lat_s))
+        longitude = _dms_to_degrees(float(lon_d), float(lon_m), float(lon_s))
+        if str(gps.get(1, '')).startswith('S'):
+            latitude = -latitude
+        if str(gps.get(3, '')).startswith('W'):
+            longitude = -longitude
+        return latitude, longitude
+    except Exception:
+        return _GPS_FAST_PATH_MISS
+
+def _read_gps_tags(f, buf):
+    """读取 GPS 相关 EXIF 标签，优先只解析文件前缀，必要时回退到完整读取"""
+    truncated = len(buf) == EXIF_PREFIX_BYTES and f.read(1) != b''
+    if not truncated:
+        return exifread.process_file(io.BytesIO(buf), stop_tag="GPS GPSLongitude", details=False)
+
+    if buf[:3] == b'\xff\xd8\xff' and not _jpeg_exif_truncated(buf):
+        # JPEG 的 EXIF 段完整包含在前缀中，无需读取剩余数据
+        try:
+            return exifread.process_file(io.BytesIO(buf), stop_tag="GPS GPSLongitude", details=False)
+        except exifread.exceptions.EXIFError:
+            pass # 前缀解析失败时回退到完整读取
+    else:
+        # 非 JPEG (TIFF/PNG/WebP 等) 的 EXIF 偏移可能指向文件后部，先尝试前缀，缺少 GPS 时再完整读取
+        try:
+            tags = exifread.process_file(io.BytesIO(buf), stop_tag="GPS GPSLongitude", details=False)
+            if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
+                return tags
+        except exifread.exceptions.EXIFError:
+            pass
+
+    f.seek(0)
+    return exifread.process_file(f, stop_tag="GPS GPSLongitude", details=False)
+
+def get_gps_coordinates(filepath, fp=None):
+    """从文件 EXIF 中提取 GPS 坐标；fp 为调用方已打开的文件或 mmap 时直接从头读取，不再打开文件"""
+    try:
+        with open(filepath, 'rb') if fp is None else contextlib.nullcontext(fp) as f:
+            f.seek(0)
             try:
                 # Process only necessary tags up to GPS info for efficiency
-                # Changed stop_tag to be more comprehensive
-                tags = exifread.process_file(f, stop_tag="GPS GPSLongitude", details=False)
+                # Only the file prefix holding APP1 is parsed in the common JPEG case
+                buf = f.read(EXIF_PREFIX_BYTES)
+                if buf[:3] == b'\xff\xd8\xff':
+                    # 前缀中的段结构只遍历一次，同时得到 EXIF 的位置和是否需要完整读取
+                    span, truncated = _jpeg_exif_segment(buf)
+                    if not truncated:
+                        if span is None:
+                            return None
+                        coords = _GPS_FAST_PATH_MISS
+                        if span is not _GPS_FAST_PATH_MISS:
+                            coords = _gps_from_tiff(memoryview(buf)[span[0]:span[1]])
+                        if coords is _GPS_FAST_PATH_MISS:
+                            coords = _gps_via_pillow(buf)
+                        if coords is not _GPS_FAST_PATH_MISS:
+                            return coords
+                tags = _read_gps_tags(f, buf)
 
                 # Check if GPS tags are present
                 if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
@@ -104,28 +495,70 @@ def get_gps_coordinates(filepath):
                         return latitude, longitude
                     # Added IndexError to catch potential issues with values list
                     except (AttributeError, TypeError, IndexError) as e:
-                        logging.warning(f"⚠️ 解析 GPS 坐标值失败: {filepath}，原因: {e}")
+                        logging.warning("⚠️ 解析 GPS 坐标值失败: %s，原因: %s", filepath, e)
                         return None
                 # It's also possible to have one without the other, although less useful
                 elif 'GPS GPSLatitude' in tags or 'GPS GPSLongitude' in tags:
-                     logging.warning(f"⚠️ GPS 坐标信息不完整 (仅发现Latitude或Longitude): {filepath}")
+                     logging.warning("⚠️ GPS 坐标信息不完整 (仅发现Latitude或Longitude): %s", filepath)
                      return None
                 else:
                     # No GPS tags found
                     return None
             # Catch the specific EXIFError from the submodule
             except exifread.exceptions.EXIFError as e: # <--- CHANGED THIS LINE
-                logging.warning(f"⚠️ 读取 EXIF 信息失败 (GPS 相关): {filepath}，原因: {e}")
+                logging.warning("⚠️ 读取 EXIF 信息失败 (GPS 相关): %s，原因: %s", filepath, e)
                 return None
     except FileNotFoundError:
         # This might happen if the file is deleted by another thread between finding it and processing
-        logging.debug(f"文件未找到，无法读取或处理 GPS 信息: {filepath}") # Use debug level as it's expected in concurrent runs
+        logging.debug("文件未找到，无法读取或处理 GPS 信息: %s", filepath) # Use debug level as it's expected in concurrent runs
         return None
     except Exception as e:
         # Catch other potential errors during file open or initial processing
         logging.error(f"❌ 打开文件或处理 GPS 信息失败: {filepath}，原因: {e}")
         return None
 
+def results_until_interrupted(executor, futures):
+    """按提交顺序产出 futures 的结果；等待期间定期检查中断标志，
+    收到 Ctrl+C 时取消所有尚未开始的任务并停止产出 (只等待已在执行的任务)"""
+    for future in futures:
+        while not future.done():
+            if interrupted:
+                # 在这里等待正在执行的任务结束：若不等待，随后 with 语句退出时的 shutdown() 会把进程池的取消标记重置，
+                # 排队中的任务仍会全部执行
+                executor.shutdown(wait=True, cancel_futures=True)
+                return
+            concurrent.futures.wait([future], timeout=INTERRUPT_POLL_INTERVAL)
+        yield future.result()
+
+def iter_files(root):
+    """基于 os.scandir 递归遍历目录，产出普通文件的 DirEntry (stat 结果由 DirEntry 缓存)"""
+    stack = [os.fspath(root)]
+    while stack:
+        if interrupted:
+            return
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield entry
+                    except OSError as e:
+                        logging.error("❌ 扫描文件时发生 OS 错误: %s，原因: %s", entry.path, e)
+        except OSError as e:
+            logging.error(f"❌ 无法读取目录: {current}，原因: {e}")
+
+def get_cached_gps(filepath, cache):
+    """带缓存的 GPS 坐标读取，同一文件的 EXIF 只解析一次"""
+    if filepath in cache:
+        return cache[filepath]
+
+    coords = get_gps_coordinates(filepath)
+    cache[filepath] = coords
+    return coords
+
 def compare_gps(coord1, coord2, threshold=GPS_THRESHOLD):
     """比较两个 GPS 坐标是否在阈值范围内"""
     if coord1 is None or coord2 is None:
@@ -134,75 +567,217 @@ def compare_gps(coord1, coord2, threshold=GPS_THRESHOLD):
     lat2, lon2 = coord2
     return abs(lat1 - lat2) < threshold and abs(lon1 - lon2) < threshold
 
+def _has_image_magic(head):
+    """根据文件头部字节判断是否为支持的图片格式"""
+    if head.startswith(IMAGE_MAGIC_PREFIXES):
+        return True
+    return head[:4] == b'RIFF' and head[8:12] == b'WEBP'
+
 def is_image_file(filepath):
-    """检查文件是否是 PIL 可以打开的图片文件"""
+    """检查文件是否是图片文件 (只读取文件头的魔数，不初始化解码器；损坏的图片在解码时再处理)。
+    只在感知哈希计算失败时用于决定是否警告，正常图片不会走到这里，因此不在扫描时为每个文件预读文件头"""
     # Only check common image extensions first for efficiency
-    if filepath.suffix.lower() not in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp']:
+    if filepath.suffix.lower() not in STILL_IMAGE_EXTENSIONS:
          return False
     try:
-        with Image.open(filepath) as img:
-            img.verify() # Verify file integrity
-        return True
-    except Exception: # Catch all exceptions, including UnidentifiedImageError, IOError, etc.
+        return _has_image_magic(read_prefix(filepath, IMAGE_MAGIC_BYTES))
+    except OSError:
         return False
 
 def get_image_resolution(filepath):
-    """获取图片的分辨率 (宽度 * 高度)"""
-    if not is_image_file(filepath): # Only try for recognized image files
+    """获取图片的分辨率 (宽度 * 高度)；只解析文件头，不解码像素"""
+    # 只按扩展名过滤：Image.open 自身会校验文件头，无需再由 is_image_file 额外打开一次文件
+    if filepath.suffix.lower() not in STILL_IMAGE_EXTENSIONS:
         return 0
     try:
         with Image.open(filepath) as img:
             return img.size[0] * img.size[1]
     except UnidentifiedImageError as e:
-        logging.warning(f"⚠️ 无法识别的图片格式，无法获取分辨率: {filepath}，原因: {e}")
+        logging.debug("无法识别的图片格式，无法获取分辨率: %s，原因: %s", filepath, e)
         return 0
     except FileNotFoundError:
         # This might happen if the file is deleted by another thread
-        logging.debug(f"文件未找到，无法获取分辨率: {filepath}")
+        logging.debug("文件未找到，无法获取分辨率: %s", filepath)
         return 0
     except Exception as e:
         logging.error(f"❌ 获取图片分辨率失败: {filepath}，原因: {e}")
         return 0
 
-def backup_file(file_path, perform_actions, backup_dir, source_dir_arg, simple_backup=False, simple_backup_with_path=False, reason="", overwrite_files=False):
-    """备份文件到指定目录"""
-    if not perform_actions:
-        log_message(f"备份: {file_path} -> {backup_dir} (模拟)", False, False)
-        return
+# copy_file_range 不可用时 (跨文件系统、内核或文件系统不支持) 回退到 shutil.copy2
+_COPY_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL}
+# Linux FICLONE ioctl (_IOW(0x94, 9, int))：btrfs/XFS 等文件系统上整文件写时复制克隆，只修改元数据
+_FICLONE = 0x40049409
+_CLONE_FALLBACK_ERRNOS = _COPY_FALLBACK_ERRNOS | {errno.ENOTTY, errno.EBADF, errno.EPERM}
 
-    original_name = file_path.stem.replace(" ", "_")
-    ext = file_path.suffix.lower()
-    # 使用文件的修改时间创建日期目录
+def _try_reflink(fsrc, fdst):
+    """尝试用 FICLONE 克隆整个文件，文件系统不支持时返回 False"""
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
     try:
-        timestamp_dir_name = datetime.fromtimestamp(file_path.stat().st_mtime).strftime('%Y-%m-%d')
-        timestamp_dir = backup_dir / timestamp_dir_name
-    except Exception as e:
-         logging.error(f"❌ 获取文件修改时间失败: {file_path}，原因: {e}. 使用当前日期代替。")
-         timestamp_dir_name = datetime.now().strftime('%Y-%m-%d_error')
-         timestamp_dir = backup_dir / timestamp_dir_name
+        fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        return True
+    except OSError as e:
+        if e.errno not in _CLONE_FALLBACK_ERRNOS:
+            raise
+        return False
 
+def fast_copy(src, dst, exclusive=False):
+    """复制文件并保留元数据；Linux 上先尝试 FICLONE 克隆 (reflink，与文件大小无关的常数时间)，
+    再使用 os.copy_file_range 在内核中完成复制 (回退的 shutil.copy2 在 Linux 上使用 sendfile)。
+    exclusive 为 True 时目标已存在则抛出 FileExistsError (创建与检查在一次 open 中原子完成)"""
+    if not exclusive:
+        _copy_file(src, dst)
+        return
+    # 先独占创建目标文件，之后的复制 (包括回退路径) 覆盖这个空文件即可；复制失败时删除，避免留下残缺的备份
+    open(dst, 'xb').close()
+    try:
+        _copy_file(src, dst)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(dst)
+        raise
+
+def _copy_file(src, dst):
+    if not hasattr(os, 'copy_file_range'):
+        shutil.copy2(src, dst)
+        return
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            if _try_reflink(fsrc, fdst):
+                remaining = 0
+            else:
+                remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+    except OSError as e:
+        if e.errno not in _COPY_FALLBACK_ERRNOS:
+            raise
+        shutil.copy2(src, dst)
+        return
+    shutil.copystat(src, dst)
+
+# 已确认存在的目录，备份同一日期目录下的大量文件时避免重复的 mkdir 系统调用。
+# 多个 I/O 线程并发调用时不加锁：set 的单次读写由 GIL 保证原子，偶尔重复一次 mkdir(exist_ok=True) 也无害
+_created_dirs = set()
+
+def ensure_dir(path):
+    """确保目录存在 (创建失败时抛出异常)，已创建过的目录直接返回"""
+    if path not in _created_dirs:
+        path.mkdir(parents=True, exist_ok=True)
+        _created_dirs.add(path)
+
+# 删除在 I/O 线程池中并发执行：回收站目标文件名的检查与占用必须原子完成，否则同名文件会互相覆盖。
+# 本次运行移入回收站的文件都先在 _reserved_trash_paths 中占用，磁盘上已存在的同名文件只可能来自之前的运行，
+# 因此 exists() 不必在锁内调用：锁只保护集合操作，不再让各 I/O 线程排队等待 stat (网络盘上每次可达数毫秒)
+_trash_lock = threading.Lock()
+_reserved_trash_paths = set()
+
+def _try_reserve_trash_path(trash_path):
+    """占用回收站中尚未被本次运行占用、磁盘上也不存在的路径，成功时返回 True"""
+    if trash_path.exists():
+        return False
+    with _trash_lock:
+        if trash_path in _reserved_trash_paths:
+            return False
+        _reserved_trash_paths.add(trash_path)
+        return True
 
-    # 确定备份路径
+def _reserve_trash_path(file_path, trash_dir):
+    """为软删除选择回收站中不冲突的目标路径并占用，返回 (目标路径, 是否因重名而改名)"""
+    trash_path = trash_dir / file_path.name
+    if _try_reserve_trash_path(trash_path):
+        return trash_path, False
+    # 已存在同名文件，加时间戳后缀；同一秒内仍冲突时再追加序号
+    name, ext = os.path.splitext(file_path.name)
+    timestamp_suffix = datetime.now().strftime('_%Y%m%d%H%M%S')
+    candidate = trash_dir / f"{name}{timestamp_suffix}{ext}"
+    counter = 1
+    while not _try_reserve_trash_path(candidate):
+        candidate = trash_dir / f"{name}{timestamp_suffix}_{counter}{ext}"
+        counter += 1
+    return candidate, True
+
+# 修改时间所在的 15 分钟区间 -> 本地日期目录名。各地时区偏移和夏令时切换都是 15 分钟的整数倍，
+# 本地零点总落在区间边界上，同一区间内的时间戳日期相同；同一批照片的修改时间通常集中在少数区间
+_DATE_BUCKET_SECONDS = 900
+_date_dir_names = {}
+
+def _date_dir_name(file_mtime):
+    """返回修改时间对应的日期目录名 'YYYY-MM-DD' (按区间缓存，省去每个文件的 fromtimestamp + strftime)"""
+    bucket = int(file_mtime // _DATE_BUCKET_SECONDS)
+    name = _date_dir_names.get(bucket)
+    if name is None:
+        name = _date_dir_names[bucket] = datetime.fromtimestamp(file_mtime).strftime('%Y-%m-%d')
+    return name
+
+# {(备份目录, 源目录, 是否保留原路径, 日期目录名, 源文件所在目录): 已创建的备份目标目录}
+_backup_target_dirs = {}
+
+def _backup_target_dir(file_path, config, timestamp_dir_name):
+    """返回文件的备份目标目录 (确保已存在)，无法创建时返回 None；
+    按 (日期, 源文件所在目录) 缓存，同一目录下的大量文件不再逐个拼接 Path、计算相对路径"""
+    key = (config.backup_dir, config.source_dirs, config.simple_backup_with_path, timestamp_dir_name,
+           os.path.dirname(os.fspath(file_path)))
+    target_dir = _backup_target_dirs.get(key)
+    if target_dir is not None:
+        return target_dir
+
+    timestamp_dir = config.backup_dir / timestamp_dir_name
     target_dir = timestamp_dir
-    if simple_backup_with_path:
-        # 构建相对于源目录的路径
+    if config.simple_backup_with_path:
+        # 构建相对于文件所在源目录的路径
         try:
-            relative_path = file_path.relative_to(source_dir_arg).parent
-            target_dir = timestamp_dir / relative_path
-        except ValueError:
-            # 如果文件不在源目录下 (例如来自可选目录)，则直接放在日期目录下
-            logging.warning(f"⚠️ 文件 {file_path} 不在源目录 {source_dir_arg} 下，无法构建相对路径备份。备份到 {timestamp_dir}")
-            target_dir = timestamp_dir
+            for source_dir in config.source_dirs:
+                try:
+                    target_dir = timestamp_dir / file_path.relative_to(source_dir).parent
+                    break
+                except ValueError:
+                    continue
+            else:
+                # 如果文件不在任何源目录下，则直接放在日期目录下
+                logging.warning("⚠️ 文件 %s 不在源目录 %s 下，无法构建相对路径备份。备份到 %s", file_path, config.source_dirs, timestamp_dir)
         except Exception as e:
             logging.error(f"❌ 构建相对备份路径失败: {file_path}，原因: {e}. 备份到 {timestamp_dir}")
             target_dir = timestamp_dir
 
     # 确保目标目录存在
     try:
-         target_dir.mkdir(parents=True, exist_ok=True)
+         ensure_dir(target_dir)
     except Exception as e:
          logging.error(f"❌ 创建备份目录失败: {target_dir}，原因: {e}")
-         return # 如果目录无法创建，则跳过备份
+         return None
+    _backup_target_dirs[key] = target_dir
+    return target_dir
+
+def backup_file(file_path, config, reason="", file_mtime=None, name_tag=None):
+    """备份文件到 config.backup_dir (file_mtime 为扫描阶段缓存的修改时间，缺省时才调用 stat；
+    name_tag 为默认模式下文件名中的短标识，缺省时计算文件哈希)"""
+    perform_actions = config.perform_actions
+    backup_dir = config.backup_dir
+    simple_backup = config.simple_backup
+    simple_backup_with_path = config.simple_backup_with_path
+    if not perform_actions:
+        log_message("备份: %s -> %s (模拟)", False, False, file_path, backup_dir)
+        return
+
+    original_name = file_path.stem.replace(" ", "_")
+    ext = file_path.suffix.lower()
+    # 使用文件的修改时间创建日期目录
+    try:
+        if file_mtime is None:
+            file_mtime = file_path.stat().st_mtime
+        timestamp_dir_name = _date_dir_name(file_mtime)
+    except Exception as e:
+         logging.error(f"❌ 获取文件修改时间失败: {file_path}，原因: {e}. 使用当前日期代替。")
+         timestamp_dir_name = datetime.now().strftime('%Y-%m-%d_error')
+
+    # 确定并创建备份目标目录
+    target_dir = _backup_target_dir(file_path, config, timestamp_dir_name)
+    if target_dir is None:
+        return # 如果目录无法创建，则跳过备份
 
     # 确定最终文件名
     if simple_backup:
@@ -215,279 +790,601 @@ def backup_file(file_path, perform_actions, backup_dir, source_dir_arg, simple_b
         backup_path = target_dir / f"{original_name}{ext}"
     else:
         # 默认模式：原始文件名 + 原因 + 哈希
-        file_hash_name = file_hash(file_path)
-        if file_hash_name is None:
-             logging.error(f"❌ 无法计算文件哈希，跳过备份: {file_path}")
-             return
+        if name_tag is None:
+            file_hash_name = file_hash(file_path, config.hash_algo)
+            if file_hash_name is None:
+                 logging.error(f"❌ 无法计算文件哈希，跳过备份: {file_path}")
+                 return
+            name_tag = file_hash_name[:8] # 使用哈希前8位避免文件名过长
         suffix = f"_{reason}" if reason else ""
-        new_file_name = f"{original_name}{suffix}_{file_hash_name[:8]}{ext}" # 使用哈希前8位避免文件名过长
+        new_file_name = f"{original_name}{suffix}_{name_tag}{ext}"
         backup_path = target_dir / new_file_name
 
-    # 如果备份路径已存在，根据 overwrite_files 选择是否覆盖
-    if backup_path.exists():
-        if overwrite_files:
-            logging.info(f"文件已存在，覆盖: {backup_path}")
-        else:
-            logging.info(f"备份文件已存在，跳过备份: {backup_path}")
+    # 保留原路径时目录可能很深：超出平台路径长度限制的改为直接放在日期目录下 (只是一次整数比较)
+    if len(os.fspath(backup_path)) > MAX_PATH_LENGTH and target_dir != backup_dir / timestamp_dir_name:
+        flat_path = backup_dir / timestamp_dir_name / backup_path.name
+        logging.warning("⚠️ 备份路径超出长度限制 (%d)，改为备份到 %s: %s", MAX_PATH_LENGTH, flat_path, backup_path)
+        backup_path = flat_path
+        try:
+            ensure_dir(backup_path.parent)
+        except Exception as e:
+            logging.error(f"❌ 创建备份目录失败: {backup_path.parent}，原因: {e}")
             return
 
+    # 如果备份路径已存在，根据 overwrite_files 选择是否覆盖；
+    # 不覆盖时由 fast_copy 独占创建目标文件，省去一次 stat，也不会与其他 I/O 线程同时写同一个备份
+    if config.overwrite_files and backup_path.exists():
+        logging.info("文件已存在，覆盖: %s", backup_path)
+
     # 备份文件
     try:
-        shutil.copy2(file_path, backup_path)
-        log_message(f"已备份: {file_path} → {backup_path}", True, perform_actions)
+        fast_copy(file_path, backup_path, exclusive=not config.overwrite_files)
+        log_message("已备份: %s → %s", True, perform_actions, file_path, backup_path)
+    except FileExistsError:
+        logging.info("备份文件已存在，跳过备份: %s", backup_path)
     except Exception as e:
         logging.error(f"❌ 备份文件失败: {file_path} 到 {backup_path}，原因: {e}")
 
-def log_message(message, enable_console_log, is_executing):
-    """根据参数决定是否同时输出日志到控制台"""
+class SizeRotatingFileHandler(RotatingFileHandler):
+    """按大小轮转的日志文件处理器。基类每写一条记录前都先 stat 两次日志文件 (exists + isfile，
+    只为不轮转非普通文件)；这里先按大小判断，只有确实需要轮转时才交给基类做这项检查"""
+
+    def shouldRollover(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        if self.maxBytes <= 0:
+            return False
+        msg = "%s\n" % self.format(record)
+        self.stream.seek(0, 2)
+        if self.stream.tell() + len(msg) < self.maxBytes:
+            return False
+        return super().shouldRollover(record)
+
+class LocalQueueHandler(QueueHandler):
+    """同一进程内的日志队列处理器。基类 prepare 会在调用线程中先格式化消息并复制记录 (为跨进程 pickle 准备)；
+    队列只在本进程内传递时直接放入原记录，格式化由监听线程的处理器完成"""
+
+    def prepare(self, record):
+        return record
+
+def log_message(message, enable_console_log, is_executing, *args):
+    """根据参数决定是否同时输出日志到控制台 (args 为 message 中 % 占位符的参数，由日志监听线程格式化)"""
     # 日志格式已在 main 中配置，这里只负责调用 logging.info
-    logging.info(message)
+    logging.info(message, *args)
     # 只有当 enable_console_log 为 True 时才打印到控制台
     # 注意：这里不再使用 print 直接输出，而是依赖于 logging handler
     # 如果 logging 配置中包含了 StreamHandler 并且 enable_console_log 为 True，消息会自动输出到控制台
     pass # Remove direct print here
 
 # Modified log_message to use logging levels and ensure console output via handler
-def log_action(level, message, enable_console_log):
+def log_action(level, message, enable_console_log, *args):
     """Log a message with a specific level, optionally printing to console."""
-    logger = logging.getLogger() # Get the root logger
-
-    # Check if a console handler is already attached
-    has_console_handler = any(isinstance(h, logging.StreamHandler) for h in logger.handlers)
-
-    # If console output is enabled and no console handler exists, add one temporarily
-    # This ensures messages are printed even if the main console handler setup is complex
-    # However, it's better to rely on the main setup in __main__
-    # Simpler approach: just log, and the main setup handles console output
-    if level == logging.INFO:
-        logging.info(message)
-    elif level == logging.WARNING:
-        logging.warning(message)
-    elif level == logging.ERROR:
-        logging.error(message)
-    elif level == logging.DEBUG:
-        logging.debug(message)
-    else:
-        logging.info(message) # Default to info
+    # Console output is handled by the StreamHandler configured in __main__
+    # 控制台输出由 config.enable_console_log 在 __main__ 中决定，这里直接按级别转发；
+    # 每个文件都会调用，参数原样交给 logging，拼接字符串的工作留给日志监听线程 (见 LocalQueueHandler)
+    logging.log(level, message, *args)
 
     # No need for explicit print here if StreamHandler is configured in __main__
     # If enable_console_log is True, the StreamHandler added in __main__ will handle it.
     pass
 
 
-def safe_delete_file(file_path, perform_actions, backup_dir, delete_soft, trash_dir, enable_console_log, source_dir_arg, simple_backup=False, simple_backup_with_path=False, reason=""):
-    """安全删除文件，可选备份或软删除"""
+def safe_delete_file(file_path, config, reason="", file_mtime=None):
+    """安全删除文件，可选备份或软删除 (行为由 config 决定)"""
+    perform_actions = config.perform_actions
+    enable_console_log = config.enable_console_log
     # Use log_action for messages that might interfere with progress bar
     if not perform_actions:
-        log_action(logging.INFO, f"[删除]: {file_path} (模拟)", enable_console_log)
+        log_action(logging.INFO, "[删除]: %s (模拟)", enable_console_log, file_path)
         return True # 模拟删除成功
 
     # 在执行删除前，先检查文件是否存在，防止重复删除或删除不存在的文件
     if not file_path.exists():
-        log_action(logging.WARNING, f"⚠️ 尝试删除文件 {file_path}，但文件不存在。跳过删除。", enable_console_log)
+        log_action(logging.WARNING, "⚠️ 尝试删除文件 %s，但文件不存在。跳过删除。", enable_console_log, file_path)
         return False # 文件不存在，无需删除
 
     deleted_successfully = False
-    if delete_soft and trash_dir:
+    if config.delete_soft and config.trash_dir:
         # 软删除 (移动到回收站目录)
-        trash_path = Path(trash_dir) / file_path.name # 简单地移动到回收站根目录，可能会有文件名冲突
+        trash_path = config.trash_dir / file_path.name # 简单地移动到回收站根目录，可能会有文件名冲突
         # 更好的软删除方式是保留部分原目录结构，或者在文件名后加时间戳/哈希
         # 为了简单，这里只移动到根目录，但如果文件名冲突，需要处理（比如加后缀）
         # shutil.move 如果目标存在且不是目录，会覆盖。如果是目录，会移动到目录下。
-        # 如果目标路径已存在同名文件，这里会抛出 FileExistsError 或 IsADirectoryError
         try:
-            # 如果目标已存在同名文件，加个后缀
-            if trash_path.exists():
-                name, ext = os.path.splitext(trash_path.name)
-                timestamp_suffix = datetime.now().strftime('_%Y%m%d%H%M%S')
-                trash_path = trash_path.with_name(f"{name}{timestamp_suffix}{ext}")
-                log_action(logging.WARNING, f"⚠️ 回收站已存在同名文件 {file_path.name}，移动到 {trash_path}", enable_console_log)
+            # 如果目标已存在同名文件 (或被其他线程占用)，加个后缀
+            trash_path, renamed = _reserve_trash_path(file_path, config.trash_dir)
+            if renamed:
+                log_action(logging.WARNING, "⚠️ 回收站已存在同名文件 %s，移动到 %s", enable_console_log, file_path.name, trash_path)
 
             # 确保回收站目录存在
-            trash_path.parent.mkdir(parents=True, exist_ok=True)
+            ensure_dir(trash_path.parent)
 
-            shutil.move(str(file_path), str(trash_path))
-            log_action(logging.INFO, f"[软删除] 已移动到 {trash_path}: {file_path}", enable_console_log)
+            try:
+                # 目标路径已确认不存在：同一文件系统上一次 rename 即可 (shutil.move 还会先检查目标是否为目录)；
+                # 回收站在其他设备上时才由 shutil.move 复制后删除
+                os.rename(file_path, trash_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.move(str(file_path), str(trash_path))
+            log_action(logging.INFO, "[软删除] 已移动到 %s: %s", enable_console_log, trash_path, file_path)
             deleted_successfully = True
+        except PermissionError as e:
+            log_action(logging.WARNING, "⚠️ [软删除] 无写入权限，保留文件 %s: %s", enable_console_log, file_path, e)
         except Exception as e:
-            log_action(logging.ERROR, f"❌ [软删除] 移动文件失败 {file_path} 到 {trash_path}: {e}", enable_console_log)
+            log_action(logging.ERROR, "❌ [软删除] 移动文件失败 %s 到 %s: %s", enable_console_log, file_path, trash_path, e)
             deleted_successfully = False # 移动失败，视为删除失败
     else: # 默认行为：先备份再硬删除
         # 备份文件
         # 在执行删除前调用备份
-        backup_file(file_path, perform_actions, backup_dir, source_dir_arg, simple_backup=simple_backup, simple_backup_with_path=simple_backup_with_path, reason=reason)
+        backup_file(file_path, config, reason=reason, file_mtime=file_mtime)
 
         # 执行硬删除
         try:
             file_path.unlink() # 硬删除
-            log_action(logging.INFO, f"[删除] (备份已完成): {file_path}", enable_console_log)
+            log_action(logging.INFO, "[删除] (备份已完成): %s", enable_console_log, file_path)
             deleted_successfully = True
+        except PermissionError as e:
+            log_action(logging.WARNING, "⚠️ 文件无写入权限，保留文件 %s: %s", enable_console_log, file_path, e)
         except Exception as e:
-            log_action(logging.ERROR, f"❌ 硬删除文件失败 {file_path}: {e}", enable_console_log)
+            log_action(logging.ERROR, "❌ 硬删除文件失败 %s: %s", enable_console_log, file_path, e)
             deleted_successfully = False # 删除失败
 
     return deleted_successfully # 返回是否删除成功
 
-def calculate_phash(filepath, cache, phash_cache_lock):
-    """计算图片的感知哈希，带缓存和线程锁"""
-    with phash_cache_lock:
-        if filepath in cache:
-            return cache[filepath]
-
-    # 如果不在缓存中，计算并存入
-    phash_val = None
-    if not is_image_file(filepath): # 只有图片才能计算phash
-         logging.debug(f"跳过文件 {filepath} 的感知哈希计算，因为它不是图片。")
-         return None
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+def _popcount64_swar(x):
+    """向量化 64 位 popcount (SWAR)，x 为 np.uint64 数组"""
+    x = x - ((x >> np.uint64(1)) & _M1)
+    x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x = (x + (x >> np.uint64(4))) & _M4
+    return (x * _H01) >> np.uint64(56)
+
+# NumPy >= 2.0 的 bitwise_count 直接使用 CPU 的 popcount 指令，旧版本使用 SWAR 实现
+popcount64 = getattr(np, 'bitwise_count', _popcount64_swar)
+
+# 候选数不超过该值时逐个用整数比较，省去构造 numpy 临时数组的开销
+SCALAR_SCAN_LIMIT = 32
+
+# 多索引哈希 (multi-index hashing)：64 位 phash 切成 4 段 16 位，
+# 汉明距离 <= t 的两个哈希必有一段的差异位数 <= t // 4 (鸽巢原理)
+# (BK 树在 64 位哈希、阈值 5 时仍要访问大部分节点，且每个节点一次 Python 层比较：
+#  1.6 万/10 万条时每次查询约 0.8/4.6 ms，本索引约 17/26 us)
+MIH_CHUNKS = 4
+MIH_CHUNK_BITS = 16
+MIH_MAX_RADIUS = 1 # 每段最多探测翻转 1 位的邻居，阈值更大时退回全量向量化扫描
+# (只按最高 8 位分桶的粗筛不可取：阈值 5 时 256 个桶中有 219 个与查询的差异位数 <= 5，几乎等于全量扫描)
+# 条目少于该值时全量向量化扫描比 4x17 次分段探测更快 (实测交叉点约 1.6 万条)
+MIH_MIN_ENTRIES = 16384
+# 候选条目数 (含重复) 超过总数的 1/64 时改为全量扫描：向量化 popcount 每条约 1 ns，按下标收集候选每条约 80 ns
+MIH_FULL_SCAN_RATIO = 64
+_CHUNK_MASK = (1 << MIH_CHUNK_BITS) - 1
+PHASH_COMPACT_MIN = 1024 # 条目较少时无效条目的扫描开销可以忽略，不值得压缩
+# 分段表建立后，新条目积累到该数量再并入 (并入是 O(n) 的数组插入；未并入的尾部每次查询全量比较)
+MIH_TAIL_ENTRIES = 4096
+# 每段翻转 0 或 1 位的探测取值 (第 0 列为不翻转)
+_PROBE_FLIPS = np.array([0] + [1 << b for b in range(MIH_CHUNK_BITS)], dtype=np.intp)[None, :]
+_CHUNK_SHIFTS = np.arange(MIH_CHUNKS, dtype=np.uint64)[:, None] * np.uint64(MIH_CHUNK_BITS)
+_CHUNK_OFFSETS = np.arange(MIH_CHUNKS, dtype=np.intp)[:, None] << MIH_CHUNK_BITS
+
+class PhashIndex:
+    """感知哈希索引：64 位 phash 存放在连续的 np.uint64 数组中，
+    先用 16 位分段表筛选候选，再用向量化 XOR + popcount 精确计算汉明距离"""
+
+    def __init__(self, capacity=1024):
+        self._hashes = np.empty(capacity, dtype=np.uint64)
+        self._alive = np.zeros(capacity, dtype=bool) # 删除时只打标记 (O(1))，查询时过滤
+        self._xor = np.empty(capacity, dtype=np.uint64) # 全量比较时 XOR 结果的复用缓冲区，每次查询不再分配
+        self._infos = [] # 与 _hashes 下标一一对应的 FileInfo
+        self._ints = [] # 与 _hashes 相同的值，以 Python int 保存，供少量候选时标量比较
+        self._slots = {} # {file_path: 下标}，只包含未删除的条目
+        # 分段表 (order, starts)：4 段的 16 位取值各占一个 65536 的区间 (段号 << 16 | 取值)，
+        # order 是按该组合取值排序的下标 (uint32)，starts 是每个取值在 order 中的起始位置，每个条目每段只占 4 字节；
+        # 条目数达到 MIH_MIN_ENTRIES 前只用 popcount 全量扫描，不建立分段表
+        self._tables = None
+        self._indexed = 0 # 已并入分段表的条目数，之后加入的条目 (连续的尾部) 查询时直接全量比较
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, file_path):
+        return file_path in self._slots
+
+    def add(self, file_info, phash_int):
+        """加入一个文件的 phash (64 位整数)"""
+        n = len(self._infos)
+        if n == len(self._hashes):
+            # 容量不足时按倍数扩容，避免每次插入都重新分配数组
+            grown = np.empty(max(1, n * 2), dtype=np.uint64)
+            grown[:n] = self._hashes
+            self._hashes = grown
+            alive = np.zeros(len(grown), dtype=bool)
+            alive[:n] = self._alive[:n]
+            self._alive = alive
+            self._xor = np.empty(len(grown), dtype=np.uint64)
+        self._hashes[n] = phash_int
+        self._alive[n] = True
+        self._infos.append(file_info)
+        self._ints.append(phash_int)
+        self._slots[file_info.path] = n
+
+    def _table_keys(self, start, stop):
+        """下标 [start, stop) 条目在分段表中的组合取值，依次为第 0..3 段 (每段 stop-start 个)"""
+        keys = (self._hashes[start:stop] >> _CHUNK_SHIFTS) & np.uint64(_CHUNK_MASK)
+        return (keys.astype(np.intp) + _CHUNK_OFFSETS).ravel()
+
+    def _build_tables(self):
+        """按现有条目 (含已删除的，查询时由 _alive 过滤) 建立分段表"""
+        n = len(self._infos)
+        keys = self._table_keys(0, n)
+        starts = np.zeros(MIH_CHUNKS << MIH_CHUNK_BITS | 1, dtype=np.intp)
+        np.cumsum(np.bincount(keys, minlength=MIH_CHUNKS << MIH_CHUNK_BITS), out=starts[1:])
+        # 第 i 个组合取值属于下标 i % n 的条目；稳定排序保证同一取值内下标递增
+        self._tables = ((np.argsort(keys, kind='stable') % max(n, 1)).astype(np.uint32), starts)
+        self._indexed = n
+
+    def _merge_tail(self):
+        """把建表之后加入的条目并入分段表 (一次 O(n) 的数组插入，尾部积累到 MIH_TAIL_ENTRIES 条才做一次)"""
+        n = len(self._infos)
+        order, starts = self._tables
+        keys = self._table_keys(self._indexed, n)
+        tail = np.tile(np.arange(self._indexed, n, dtype=np.uint32), MIH_CHUNKS)
+        # 插入到各取值已有条目之后 (np.insert 的位置相对原数组)；插入位置相同的元素保持给定的先后顺序，
+        # 而相邻取值之间常是空区间 (多个取值的插入位置相同)，所以尾部必须先按取值排序，否则会落入错误的区间
+        # (稳定排序：同一取值内仍按下标递增)
+        srt = np.argsort(keys, kind='stable')
+        order = np.insert(order, starts[keys[srt] + 1], tail[srt])
+        starts[1:] += np.cumsum(np.bincount(keys, minlength=MIH_CHUNKS << MIH_CHUNK_BITS))
+        self._tables = (order, starts)
+        self._indexed = n
+
+    def _compact(self):
+        """丢弃已删除的条目，保持加入顺序 (分段表在下次需要时重建)"""
+        live = np.flatnonzero(self._alive[:len(self._infos)])
+        self._hashes[:len(live)] = self._hashes[live]
+        self._alive[:] = False
+        self._alive[:len(live)] = True
+        self._infos = [self._infos[i] for i in live]
+        self._ints = [self._ints[i] for i in live]
+        self._slots = {info.path: i for i, info in enumerate(self._infos)}
+        self._tables = None
+        self._indexed = 0
+
+    def remove(self, file_path):
+        """移除文件 (已被删除的图片不再作为比较对象)，不存在时忽略"""
+        slot = self._slots.pop(file_path, None)
+        if slot is not None:
+            self._alive[slot] = False
+            if len(self._slots) * 2 < len(self._infos) >= PHASH_COMPACT_MIN:
+                # 已删除的条目过半时压缩 (每次压缩后至少再删除一半才会再次触发，摊还 O(1))，
+                # 避免查询一直扫描无效条目
+                self._compact()
+
+    def _distances(self, phash_int, start, stop):
+        """下标 [start, stop) 条目与 phash_int 的汉明距离 (XOR 写入复用的缓冲区)"""
+        xor = self._xor[start:stop]
+        np.bitwise_xor(self._hashes[start:stop], np.uint64(phash_int), out=xor)
+        return popcount64(xor)
+
+    def _scan_all(self, phash_int, threshold, n):
+        """在连续数组上全量比较 (无需按下标收集)，返回与 find 相同的结果"""
+        if n <= SCALAR_SCAN_LIMIT:
+            # 运行初期索引很小，逐个 int.bit_count 比较并在同一遍中判断存活，比 numpy 的固定开销 (约 3.5 us) 快
+            alive = self._alive
+            return [(self._infos[i], h) for i, h in enumerate(self._ints) if (h ^ phash_int).bit_count() <= threshold and alive[i]]
+        hits = self._distances(phash_int, 0, n) <= threshold
+        if len(self._slots) < n:
+            # 只有存在已删除的条目时才需要再与存活标记相与 (原地运算，不再分配数组)
+            hits &= self._alive[:n]
+        return [(self._infos[i], self._ints[i]) for i in np.flatnonzero(hits).tolist()]
+
+    def find(self, phash_int, threshold):
+        """返回汉明距离不超过 threshold 的 [(FileInfo, phash_int)]，按加入顺序排列"""
+        n = len(self._infos)
+        if not self._slots:
+            return []
+        radius = threshold // MIH_CHUNKS
+        if radius > MIH_MAX_RADIUS or n < MIH_MIN_ENTRIES:
+            # 阈值过大或条目不多时，分段探测的候选集不再有优势，直接全量扫描
+            return self._scan_all(phash_int, threshold, n)
+        if self._tables is None:
+            self._build_tables()
+        elif n - self._indexed >= MIH_TAIL_ENTRIES:
+            self._merge_tail()
+        indexed = self._indexed
+        order, starts = self._tables
+        keys = [(phash_int >> (k * MIH_CHUNK_BITS)) & _CHUNK_MASK for k in range(MIH_CHUNKS)]
+        probes = (_PROBE_FLIPS[:, :1] if radius == 0 else _PROBE_FLIPS) ^ np.array(keys)[:, None]
+        probes = (probes + _CHUNK_OFFSETS).ravel()
+        begins = starts[probes]
+        lengths = starts[probes + 1] - begins
+        total = int(lengths.sum())
+        if total * MIH_FULL_SCAN_RATIO > n:
+            # 分段取值高度集中 (如大量纯色/暗部图片) 时桶很大，逐个收集候选反而比全量向量化扫描慢得多
+            return self._scan_all(phash_int, threshold, n)
+        result = []
+        if total:
+            # 各桶在 order 中的区间一次性展开为下标 (空桶长度为 0 自然跳过)，不逐个切片再拼接；
+            # 同一条目可能在多段中命中：先比较再对 (通常很少的) 结果去重并按下标 (即加入顺序) 排列，
+            # 比先对全部候选 np.unique 便宜得多
+            positions = np.repeat(begins - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+            candidates = order[positions]
+            if len(candidates) <= SCALAR_SCAN_LIMIT:
+                # 汉明距离直接用 int.bit_count (CPU 的 popcount 指令)，在推导式中内联，不为每个候选调用函数
+                ints = self._ints
+                hits = {i for i in candidates.tolist() if (ints[i] ^ phash_int).bit_count() <= threshold}
+            else:
+                hits = popcount64(self._hashes[candidates] ^ np.uint64(phash_int)) <= threshold
+                hits = set(candidates[hits].tolist())
+            result = [(self._infos[i], self._ints[i]) for i in sorted(hits) if self._alive[i]]
+        if indexed < n:
+            # 尚未并入分段表的尾部 (下标都大于表中条目) 直接全量比较，结果接在后面仍按加入顺序
+            distances = self._distances(phash_int, indexed, n)
+            tail = np.flatnonzero((distances <= threshold) & self._alive[indexed:n]) + indexed
+            result += [(self._infos[i], self._ints[i]) for i in tail.tolist()]
+        return result
+
+# phash 与 imagehash.phash 相同：32x32 灰度图做二维 DCT-II，取左上 8x8 低频与中位数比较。
+# 只需要低频部分，因此直接用 8x32 的 DCT 矩阵相乘，一批图片一次矩阵运算完成
+# 每张图的 DCT 只需约 2 us，耗时几乎全在 JPEG 解码 (约 20 ms)；dhash/ahash 同样要先解码，用作预筛选省不下时间
+# 矩阵只有 8x32，改用 float32 并不更快 (32 张一批约 42 us 对 45 us)，保持 float64 与 imagehash 的结果逐位一致
+PHASH_SIZE = 8
+PHASH_IMG_SIZE = PHASH_SIZE * 4
+_n = np.arange(PHASH_IMG_SIZE)
+_DCT_LOW = 2 * np.cos(np.pi * np.arange(PHASH_SIZE)[:, None] * (2 * _n[None, :] + 1) / (2 * PHASH_IMG_SIZE))
+del _n
+_MEDIAN_POSITIONS = [PHASH_SIZE * PHASH_SIZE // 2 - 1, PHASH_SIZE * PHASH_SIZE // 2]
+
+def phash_from_pixels(pixels):
+    """由 (B, 32, 32) 灰度像素批量计算 phash，返回 B 个 64 位整数"""
+    low = _DCT_LOW @ pixels @ _DCT_LOW.T # (B, 8, 8)
+    flat = low.reshape(len(low), -1)
+    # 形状固定为 64 个系数：中位数就是第 32、33 小的两个值的平均，直接 partition 这两个位置，省去 np.median 的通用开销
+    median = np.partition(flat, _MEDIAN_POSITIONS, axis=1)[:, _MEDIAN_POSITIONS].mean(axis=1, keepdims=True)
+    bits = flat > median
+    # 每行 64 位打包成 8 字节，按大端 uint64 整体解释，整批一次转换为 Python int
+    return np.packbits(bits, axis=1).view('>u8').ravel().tolist()
+
+def phashes_from_pixel_list(pixel_list):
+    """像素列表 (元素为 32x32 数组或 None) 整批只做一次 DCT，返回对应的 phash 列表 (像素为 None 处为 None)"""
+    decoded = [pixels for pixels in pixel_list if pixels is not None]
+    phashes = iter(phash_from_pixels(np.stack(decoded)) if decoded else [])
+    return [next(phashes) if pixels is not None else None for pixels in pixel_list]
+
+def load_phash_pixels(filepath, with_gps=False, fp=None):
+    """打开图片一次，返回 (32x32 灰度像素 float64 数组, 分辨率)，失败时像素为 None；
+    with_gps 为 True 时额外返回同一次打开读到的 GPS (无法从中得到时为 _GPS_FAST_PATH_MISS)；
+    fp 为已读入内存的文件内容 (如 mmap) 时直接从中解码，不再打开文件"""
+    pixels = None
+    resolution = 0
+    gps = _GPS_FAST_PATH_MISS
+    # 只有图片才能计算phash；文件头由 Image.open 校验，这里只按扩展名过滤，避免额外打开一次文件
+    if filepath.suffix.lower() not in STILL_IMAGE_EXTENSIONS:
+         logging.debug("跳过文件 %s 的感知哈希计算，因为它不是图片。", filepath)
+         return (None, 0, gps) if with_gps else (None, 0)
 
     try:
-        with Image.open(filepath) as img:
-            phash_val = imagehash.phash(img.convert('RGB'))
-        with phash_cache_lock: # 再次获取锁，确保写入缓存是线程安全的
-             cache[filepath] = phash_val
+        with Image.open(filepath if fp is None else fp) as img:
+            # 分辨率取自文件头，无需解码像素
+            resolution = img.size[0] * img.size[1]
+            if with_gps:
+                gps = _gps_from_image(img)
+            # JPEG 可在 DCT 域直接按 1/2~1/8 缩放解码；phash 本就缩放到 32x32
+            # 请求灰度输出：libjpeg 直接输出亮度通道，跳过色度解码和颜色转换 (非 JPEG 时 draft 无效果)
+            img.draft('L', (PHASH_DRAFT_SIZE, PHASH_DRAFT_SIZE))
+            # 已是灰度 (draft 后的 JPEG、灰度 PNG 等) 时直接缩放，convert('L') 会先完整复制一份像素
+            gray = img if img.mode == 'L' else img.convert('L')
+            small = gray.resize((PHASH_IMG_SIZE, PHASH_IMG_SIZE), Image.Resampling.LANCZOS)
+            pixels = np.asarray(small, dtype=np.float64)
     except UnidentifiedImageError as e:
-        logging.warning(f"⚠️ 无法识别的图片格式，无法计算感知哈希: {filepath}，原因: {e}")
+        logging.debug("无法识别的图片格式，无法计算感知哈希: %s，原因: %s", filepath, e)
     except FileNotFoundError:
         # This might happen if the file is deleted by another thread
-        logging.debug(f"文件未找到，无法计算感知哈希: {filepath}")
+        logging.debug("文件未找到，无法计算感知哈希: %s", filepath)
     except Exception as e:
         logging.error(f"❌ 计算感知哈希失败: {filepath}，原因: {e}")
 
+    return (pixels, resolution, gps) if with_gps else (pixels, resolution)
+
+def compute_image_signature(filepath):
+    """返回 (感知哈希 64 位整数, 分辨率)，不使用缓存，可在子进程中运行"""
+    pixels, resolution = load_phash_pixels(filepath)
+    if pixels is None:
+        return None, resolution
+    return phash_from_pixels(pixels[None])[0], resolution
+
+def calculate_phash(filepath, cache, resolution_cache):
+    """计算图片的感知哈希 (64 位整数)，带缓存；分辨率顺带写入 resolution_cache"""
+    if filepath in cache:
+        return cache[filepath]
+
+    # 如果不在缓存中，计算并存入
+    phash_val, resolution = compute_image_signature(filepath)
+    if phash_val is not None:
+        cache[filepath] = phash_val
+        resolution_cache[filepath] = resolution
     return phash_val
 
+def get_cached_resolution(filepath, resolution_cache):
+    """优先使用计算感知哈希时记录的分辨率，缓存缺失时才重新读取文件头"""
+    resolution = resolution_cache.get(filepath)
+    if resolution is None:
+        resolution = get_image_resolution(filepath)
+    return resolution
+
+def available_cpus():
+    """当前进程可用的 CPU 数 (考虑 CPU 亲和性/容器限制)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def start_worker_log_forwarding():
+    """子进程继承的日志队列只存在于子进程内存中，记录会丢失；
+    改用 multiprocessing 队列把子进程日志交回主进程的日志处理器，返回 (队列, 监听器)"""
+    worker_log_queue = multiprocessing.Queue()
+    listener = QueueListener(worker_log_queue, *logging.getLogger().handlers)
+    listener.start()
+    return worker_log_queue, listener
+
+def _init_feature_worker(worker_log_queue=None):
+    """特征预计算子进程的初始化：Ctrl+C 只由主进程处理，日志转发到主进程；
+    预先导入常用格式插件 (fork 启动时已从主进程继承，此调用直接返回)"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Image.preinit()
+    if worker_log_queue is not None:
+        logging.getLogger().handlers[:] = [QueueHandler(worker_log_queue)]
+
+def load_image_features(filepath, fp=None):
+    """读取一个文件的 (32x32 灰度像素或 None, 分辨率, GPS)；
+    JPEG 的 GPS 直接取自解码时已打开的图片，其他情况 (PNG/TIFF 等) 从同一个打开的文件再读取 EXIF"""
+    if fp is None and filepath.suffix.lower() in STILL_IMAGE_EXTENSIONS:
+        try:
+            with open(filepath, 'rb') as f:
+                return load_image_features(filepath, fp=f)
+        except OSError:
+            pass # 打开失败时按路径读取，由各自记录原因
+    pixels, resolution, gps = load_phash_pixels(filepath, with_gps=True, fp=fp)
+    if gps is _GPS_FAST_PATH_MISS:
+        gps = get_gps_coordinates(filepath, fp)
+    return pixels, resolution, gps
+
+def compute_image_features_batch(filepaths):
+    """在子进程中批量计算一组文件的感知哈希、分辨率和 GPS 坐标，返回 [(filepath, phash_int, resolution, gps)]；
+    整批像素只做一次 DCT，单个文件失败不影响同批其他文件"""
+    loaded = []
+    for filepath in iter_prefetched(filepaths):
+        try:
+            loaded.append((filepath, *load_image_features(filepath)))
+        except Exception as e:
+            logging.error(f"❌ 预计算文件 {filepath} 的特征失败: {e}")
+
+    phashes = phashes_from_pixel_list([pixels for _, pixels, _, _ in loaded])
+    return [(filepath, phash_val, resolution, gps)
+            for (filepath, _, resolution, gps), phash_val in zip(loaded, phashes)]
+
+def submit_feature_batches(executor, filepaths, workers):
+    """把一组文件按批提交到特征进程池，返回 {Future: batch}；
+    文件较少时缩小批大小，保证每个子进程都能分到任务"""
+    batch_size = max(1, min(FEATURE_BATCH_SIZE, -(-len(filepaths) // workers)))
+    batches = [filepaths[i:i + batch_size] for i in range(0, len(filepaths), batch_size)]
+    return {executor.submit(compute_image_features_batch, batch): batch for batch in batches}
+
 # Modified to return whether the *current* file being processed (file) was deleted
-# and to handle updating phash_list if the original was deleted
-def handle_similar_images(file, original_file, file_phash, original_phash, args, source_dir_arg, phash_list, phash_list_lock):
-    """处理相似图片对，根据规则决定删除哪个"""
+def handle_similar_images(file_info, original_info, config, state):
+    """处理相似图片对，根据规则决定删除哪个 (参数为扫描阶段生成的 FileInfo)；
+    两个文件在磁盘上是否存在由调用方 process_file 在候选循环外/内各检查一次"""
+    file = file_info.path
+    original_file = original_info.path
     # logging.debug(f"比较相似图片: {file} 和 {original_file}") # 这条日志可能过于频繁
 
-    # Check if files still exist
-    if not file.exists() or not original_file.exists():
-        # One or both files might have been deleted by another thread (e.g. exact duplicate)
-        logging.debug(f"相似文件 {file} 或 {original_file} 不存在，跳过相似性比较处理。")
+    # 删除操作是异步执行的，已决定删除的文件以 state.removed 为准
+    if original_file in state.removed:
+        logging.debug("相似文件 %s 已被决定删除，跳过与 %s 的比较处理。", original_file, file)
         return False # 当前文件未被删除，也不影响保留计数，因为另一个文件可能已被删除并计入
 
-    perform_actions = args.perform_actions
-    backup_dir = Path(args.backup_dir)
-    delete_soft = args.delete_soft
-    trash_dir = Path(args.trash_dir) if args.trash_dir else None
-    enable_console_log = args.log
-    simple_backup = args.simple_backup
-    simple_backup_with_path = args.simple_backup_path # Use corrected parameter name
-    prefer_resolution = args.prefer_resolution
+    prefer_resolution = config.prefer_resolution
 
-    gps_file = get_gps_coordinates(file)
-    gps_orig = get_gps_coordinates(original_file)
+    gps_file = get_cached_gps(file, state.gps_cache)
+    gps_orig = get_cached_gps(original_file, state.gps_cache)
 
     file_deleted = False # Flag to indicate if the current file ('file') was deleted
 
     # 优先级1: 含有GPS信息
     if gps_file is not None and gps_orig is None:
         # Current file has GPS, original doesn't -> keep current, delete original
-        safe_delete_file(original_file, perform_actions, backup_dir, delete_soft, trash_dir, enable_console_log, source_dir_arg, simple_backup=simple_backup, simple_backup_with_path=simple_backup_with_path, reason="gps")
-        logging.info(f"[相似] 保留含GPS: {file}, 删除: {original_file}")
-        # Original was deleted, current was kept. Need to update phash_list later if original was the list entry.
+        state.delete(original_info, config, reason="gps")
+        logging.info("[相似] 保留含GPS: %s, 删除: %s", file, original_file)
         file_deleted = False
 
     elif gps_file is None and gps_orig is not None:
         # Original has GPS, current doesn't -> keep original, delete current
-        safe_delete_file(file, perform_actions, backup_dir, delete_soft, trash_dir, enable_console_log, source_dir_arg, simple_backup=simple_backup, simple_backup_with_path=simple_backup_with_path, reason="gps")
-        logging.info(f"[相似] 保留含GPS: {original_file}, 删除: {file}")
+        state.delete(file_info, config, reason="gps")
+        logging.info("[相似] 保留含GPS: %s, 删除: %s", original_file, file)
         file_deleted = True # Current file was deleted
 
     # 优先级2: 比较分辨率或大小 (如果GPS信息相同或都没有)
     else:
         # Both have GPS (and maybe similar location) or neither has GPS
         if prefer_resolution:
-            res_file = get_image_resolution(file)
-            res_orig = get_image_resolution(original_file)
-            size_file = file.stat().st_size if file.exists() else 0 # Check exists before stat
-            size_orig = original_file.stat().st_size if original_file.exists() else 0 # Check exists before stat
+            res_file = get_cached_resolution(file, state.resolution_cache)
+            res_orig = get_cached_resolution(original_file, state.resolution_cache)
+            size_file = file_info.size # 使用扫描时缓存的大小
+            size_orig = original_info.size
 
             if res_file > res_orig:
                 # Current file has higher resolution -> keep current, delete original
-                safe_delete_file(original_file, perform_actions, backup_dir, delete_soft, trash_dir, enable_console_log, source_dir_arg, simple_backup=simple_backup, simple_backup_with_path=simple_backup_with_path, reason="resolution")
-                logging.info(f"[相似] 保留分辨率更高: {file}, 删除: {original_file}")
+                state.delete(original_info, config, reason="resolution")
+                logging.info("[相似] 保留分辨率更高: %s, 删除: %s", file, original_file)
                 file_deleted = False
             elif res_file < res_orig:
                 # Original file has higher resolution -> keep original, delete current
-                safe_delete_file(file, perform_actions, backup_dir, delete_soft, trash_dir, enable_console_log, source_dir_arg, simple_backup=simple_backup, simple_backup_with_path=simple_backup_with_path, reason="resolution")
-                logging.info(f"[相似] 保留: {original_file} (分辨率更高), 删除: {file}")
+                state.delete(file_info, config, reason="resolution")
+                logging.info("[相似] 保留: %s (分辨率更高), 删除: %s", original_file, file)
                 file_deleted = True # Current file was deleted
             else: # Resolution is the same, compare size
                 if size_file > size_orig:
                     # Current file is larger -> keep current, delete original
-                    safe_delete_file(original_file, perform_actions, backup_dir, delete_soft, trash_dir, enable_console_log, source_dir_arg, simple_backup=simple_backup, simple_backup_with_path=simple_backup_with_path, reason="larger")
-                    logging.info(f"[相似] 保留文件较大: {file}, 删除: {original_file}")
+                    state.delete(original_info, config, reason="larger")
+                    logging.info("[相似] 保留文件较大: %s, 删除: %s", file, original_file)
                     file_deleted = False
                 elif size_file < size_orig:
                     # Original file is larger -> keep original, delete current
-                    safe_delete_file(file, perform_actions, backup_dir, delete_soft, trash_dir, enable_console_log, source_dir_arg, simple_backup=simple_backup, simple_backup_with_path=simple_backup_with_path, reason="larger")
-                    logging.info(f"[相似] 保留: {original_file} (文件较大), 删除: {file}")
+                    state.delete(file_info, config, reason="larger")
+                    logging.info("[相似] 保留: %s (文件较大), 删除: %s", original_file, file)
                     file_deleted = True # Current file was deleted
                 else:
                     # Resolution and Size are the same, keep the original one encountered first (original_file)
-                    safe_delete_file(file, perform_actions, backup_dir, delete_soft, trash_dir, enable_console_log, source_dir_arg, simple_backup=simple_backup, simple_backup_with_path=simple_backup_with_path, reason="similar")
-                    logging.info(f"[相似] 保留: {original_file}, 删除: {file} (大小相同)")
+                    state.delete(file_info, config, reason="similar")
+                    logging.info("[相似] 保留: %s, 删除: %s (大小相同)", original_file, file)
                     file_deleted = True # Current file was deleted
 
         else: # Not preferring resolution, just compare size
-            size_file = file.stat().st_size if file.exists() else 0
-            size_orig = original_file.stat().st_size if original_file.exists() else 0
+            size_file = file_info.size
+            size_orig = original_info.size
 
             if size_file > size_orig:
                 # Current file is larger -> keep current, delete original
-                safe_delete_file(original_file, perform_actions, backup_dir, delete_soft, trash_dir, enable_console_log, source_dir_arg, simple_backup=simple_backup, simple_backup_with_path=simple_backup_with_path, reason="larger")
-                logging.info(f"[相似] 保留文件较大: {file}, 删除: {original_file}")
+                state.delete(original_info, config, reason="larger")
+                logging.info("[相似] 保留文件较大: %s, 删除: %s", file, original_file)
                 file_deleted = False
             elif size_file < size_orig:
                 # Original file is larger -> keep original, delete current
-                safe_delete_file(file, perform_actions, backup_dir, delete_soft, trash_dir, enable_console_log, source_dir_arg, simple_backup=simple_backup, simple_backup_with_path=simple_backup_with_path, reason="larger")
-                logging.info(f"[相似] 保留: {original_file} (文件较大), 删除: {file}")
+                state.delete(file_info, config, reason="larger")
+                logging.info("[相似] 保留: %s (文件较大), 删除: %s", original_file, file)
                 file_deleted = True # Current file was deleted
             else:
                 # Size is the same, keep the original one encountered first (original_file)
-                safe_delete_file(file, perform_actions, backup_dir, delete_soft, trash_dir, enable_console_log, source_dir_arg, simple_backup=simple_backup, simple_backup_with_path=simple_backup_with_path, reason="similar")
-                logging.info(f"[相似] 保留: {original_file}, 删除: {file} (大小相同)")
+                state.delete(file_info, config, reason="similar")
+                logging.info("[相似] 保留: %s, 删除: %s (大小相同)", original_file, file)
                 file_deleted = True # Current file was deleted
 
-    # After deciding and potentially deleting, update phash_list if the original entry was deleted
-    # This part needs the lock
-    if not file_deleted: # If the current file was NOT deleted, it means the original_file WAS deleted (or skipped)
-         # We should remove the original_file from phash_list and potentially add the current file
-         # Add the current file as the representative if it wasn't already in the list
-         # This is handled in process_file where it checks if the current file was deleted.
-         # If file_deleted is False, process_file will add the current file to phash_list later if needed.
-         pass
-
     # Return True if the CURRENT file being processed was deleted, False otherwise
     return file_deleted
 
 # Modified to return whether the *current* file being processed (file) was deleted
-def handle_exact_duplicate(file, original, args, source_dir_arg):
-    """处理完全重复的文件对，根据规则决定删除哪个"""
+def handle_exact_duplicate(file_info, original_info, config, state):
+    """处理完全重复的文件对，根据规则决定删除哪个 (参数为扫描阶段生成的 FileInfo)"""
+    file = file_info.path
+    original = original_info.path
     # logging.debug(f"处理完全重复文件: {file} 和 {original}") # 这条日志可能过于频繁
 
     # Check if files still exist
-    if not file.exists() or not original.exists():
-         logging.debug(f"重复文件 {file} 或 {original} 不存在，跳过重复处理。")
+    if original in state.removed or not file.exists() or not original.exists():
+         logging.debug("重复文件 %s 或 %s 不存在，跳过重复处理。", file, original)
          return False # 当前文件未被删除
 
     # If the file path is exactly the same, it's not a duplicate pair to handle here
     if file == original:
-         logging.debug(f"文件 {file} 是自身引用，跳过重复处理。")
+         logging.debug("文件 %s 是自身引用，跳过重复处理。", file)
          return False # 当前文件未被删除
 
-    perform_actions = args.perform_actions
-    backup_dir = Path(args.backup_dir)
-    delete_soft = args.delete_soft
-    trash_dir = Path(args.trash_dir) if args.trash_dir else None
-    enable_console_log = args.log
-    simple_backup = args.simple_backup
-    simple_backup_with_path = args.simple_backup_path # Use corrected parameter name
 
-    gps_file = get_gps_coordinates(file)
-    gps_original = get_gps_coordinates(original)
+    gps_file = get_cached_gps(file, state.gps_cache)
+    gps_original = get_cached_gps(original, state.gps_cache)
 
     file_deleted = False # Flag to indicate if the current file ('file') was deleted
 
@@ -495,344 +1392,637 @@ def handle_exact_duplicate(file, original, args, source_dir_arg):
     if gps_file is not None and gps_original is None:
         # Current file has GPS, original doesn't -> keep current, delete original
         # In exact duplicates, we usually keep the 'original' one found first (the one in seen_hashes)
-        # So, if the 'original' in seen_hashes *doesn't* have GPS but the 'current' one *does*, we should delete the 'original' and update seen_hashes
-        # This is complex with threading. A simpler rule is to keep the 'original' in seen_hashes if it has GPS, otherwise delete the current one if it has GPS.
-        # Let's stick to the rule: keep the one with GPS. If only current has GPS, keep current, delete original.
+        # So, if the 'original' in seen_hashes *doesn't* have GPS but the 'current' one *does*, we delete the 'original'
+        # and process_file makes the current file the new entry in seen_hashes.
         # This is slightly different logic for exact duplicates vs similar duplicates, but reasonable.
-         safe_delete_file(original, perform_actions, backup_dir, delete_soft, trash_dir, enable_console_log, source_dir_arg, simple_backup=simple_backup, simple_backup_with_path=simple_backup_with_path, reason="gps_duplicate")
-         logging.info(f"[重复] 保留含GPS: {file}, 删除: {original}")
+         state.delete(original_info, config, reason="gps_duplicate")
+         logging.info("[重复] 保留含GPS: %s, 删除: %s", file, original)
          file_deleted = False # Original was deleted
 
     elif gps_file is None and gps_original is not None:
         # Original has GPS, current doesn't -> keep original, delete current
-        safe_delete_file(file, perform_actions, backup_dir, delete_soft, trash_dir, enable_console_log, source_dir_arg, simple_backup=simple_backup, simple_backup_with_path=simple_backup_with_path, reason="gps_duplicate")
-        logging.info(f"[重复] 保留含GPS: {original}, 删除: {file}")
+        state.delete(file_info, config, reason="gps_duplicate")
+        logging.info("[重复] 保留含GPS: %s, 删除: %s", original, file)
         file_deleted = True # Current file was deleted
 
     # 优先级2: 如果GPS信息相同或都没有 -> 默认保留 seen_hashes 中的原文件，删除当前文件
     else:
         # Both have GPS (and possibly same location) or neither has GPS
         # Keep the original one that was recorded first (original in seen_hashes)
-        safe_delete_file(file, perform_actions, backup_dir, delete_soft, trash_dir, enable_console_log, source_dir_arg, simple_backup=simple_backup, simple_backup_with_path=simple_backup_with_path, reason="duplicate")
-        logging.info(f"[重复] 保留: {original}, 删除: {file}")
+        state.delete(file_info, config, reason="duplicate")
+        logging.info("[重复] 保留: %s, 删除: %s", original, file)
         file_deleted = True # Current file was deleted
 
     # Return True if the CURRENT file being processed was deleted, False otherwise
     return file_deleted
 
 
-# ===== 核心文件处理函数 (在线程中运行) =====
-def process_file(file, seen_hashes, phash_cache, phash_list, args, source_dir_arg,
-                 seen_hashes_lock, phash_cache_lock, phash_list_lock):
-    """处理单个文件，查找重复或相似文件，并根据规则进行操作"""
-    global interrupted
+def is_local_ssd(path):
+    """Linux 下通过 /sys/dev/block 判断路径所在设备是否为本地非旋转磁盘；网络文件系统等无法判断时返回 False"""
+    try:
+        dev = os.stat(path).st_dev
+        block = Path(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}").resolve()
+        # 分区没有 queue 目录，需要查看所属磁盘
+        for queue_dir in (block / 'queue', block.parent / 'queue'):
+            rotational = queue_dir / 'rotational'
+            if rotational.exists():
+                return rotational.read_text().strip() == '0'
+    except OSError:
+        pass
+    return False
+
+def plan_hash_chunks(infos, max_workers):
+    """把待哈希文件分成任务块：按大小从大到小排列 (最长任务优先)，每块的字节数不超过总量的 1/(8*进程数)、
+    文件数不超过 FEATURE_BATCH_SIZE。大文件 (视频) 单独成块并最先开始，空闲进程随时领取下一块，
+    避免按文件数分块时几个大文件落在同一块、最后只剩一个进程在工作"""
+    infos = sorted(infos, key=lambda info: info.size, reverse=True)
+    target = max(1, sum(info.size for info in infos) // (max_workers * 8))
+    chunks, chunk, chunk_bytes = [], [], 0
+    for info in infos:
+        if chunk and (chunk_bytes + info.size > target or len(chunk) >= FEATURE_BATCH_SIZE):
+            chunks.append(chunk)
+            chunk, chunk_bytes = [], 0
+        chunk.append(info.path)
+        chunk_bytes += info.size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def _hash_chunk(paths, algo, with_features):
+    """在工作进程/线程中计算一块文件的哈希 (with_features 时同时计算图片特征，见 file_hash_and_features)"""
+    if not with_features:
+        return [file_hash(path, algo) for path in iter_prefetched(paths)]
+    # 整块的像素一次做 DCT (与 compute_image_features_batch 相同)，只把 phash 而不是像素传回主进程
+    results = [file_hash_and_features(path, algo) for path in iter_prefetched(paths)]
+    phashes = phashes_from_pixel_list([pixels for _, pixels, _, _ in results])
+    return [(digest, phash_val, resolution, gps) for (digest, _, resolution, gps), phash_val in zip(results, phashes)]
+
+def compute_file_hashes(infos, pool_mode, source_dirs, max_workers, algo=HASH_ALGO, feature_paths=()):
+    """并行计算完整文件哈希，返回 ({path: hash 或 None}, [(path, phash, resolution, gps)])；
+    feature_paths 中的文件在同一次读取中顺带计算图片特征 (见 file_hash_and_features)。
+    进程池绕开 GIL 和 Python 层开销，适合本地固态盘；线程池适合网络盘等 I/O 受限的场景"""
+    if pool_mode == 'auto':
+        # 全部源目录的文件一起哈希：只要有一个目录不在本地固态盘上 (如网络共享)，就整体使用线程池
+        pool_mode = 'process' if all(map(is_local_ssd, source_dirs)) else 'thread'
+    logging.info(f"🔑 计算 {len(infos)} 个文件的完整哈希 ({'进程池' if pool_mode == 'process' else '线程池'})...")
+    log_listener = None
+    if pool_mode == 'process':
+        worker_log_queue, log_listener = start_worker_log_forwarding()
+        executor_cls = concurrent.futures.ProcessPoolExecutor
+        extra = {'initializer': _init_feature_worker, 'initargs': (worker_log_queue,)}
+    else:
+        executor_cls = concurrent.futures.ThreadPoolExecutor
+        extra = {}
+    # 两组任务都先提交，同时进行；同时解码的任务耗时更长，排在前面
+    chunks = [(chunk, True) for chunk in plan_hash_chunks([info for info in infos if info.path in feature_paths], max_workers)]
+    chunks += [(chunk, False) for chunk in plan_hash_chunks([info for info in infos if info.path not in feature_paths], max_workers)]
+    try:
+        with executor_cls(max_workers=max_workers, **extra) as executor:
+            futures = [executor.submit(_hash_chunk, chunk, algo, with_features) for chunk, with_features in chunks]
+            hashes = {}
+            features = []
+            # 中断时只返回已完成分块的结果
+            for (chunk, with_features), chunk_results in zip(chunks, results_until_interrupted(executor, futures)):
+                for path, result in zip(chunk, chunk_results):
+                    if with_features:
+                        digest, phash_val, resolution, gps = result
+                        hashes[path] = digest
+                        features.append((path, phash_val, resolution, gps))
+                    else:
+                        hashes[path] = result
+            return hashes, features
+    finally:
+        if log_listener is not None:
+            log_listener.stop()
 
-    # 检查全局中断标志
-    if interrupted:
-        logging.info(f"🛑 线程收到中断信号，停止处理文件: {file}")
-        return 0 # 因中断跳过，未删除文件
+def _to_sqlite_int(value):
+    """SQLite 的 INTEGER 是有符号 64 位，最高位为 1 的 phash 需要转换为负数保存"""
+    if value is None:
+        return None
+    return value - (1 << 64) if value >= 1 << 63 else value
 
-    # 再次检查文件是否存在，防止文件在扫描后和处理前被删除
-    if not file.exists():
-        logging.debug(f"文件 {file} 不存在，跳过处理。")
+def _from_sqlite_int(value):
+    if value is None:
+        return None
+    return value + (1 << 64) if value < 0 else value
+
+class FeatureCache:
+    """持久化特征缓存 (SQLite)：按 (绝对路径, 大小, 修改时间) 保存感知哈希、分辨率、GPS 和完整文件哈希，
+    再次运行时未变化的文件无需重新解码或读取。只在主线程中使用；一个实例对应本次处理的全部源目录"""
+
+    def __init__(self, db_path, source_dirs):
+        self._conn = sqlite3.connect(db_path)
+        # 扫描得到的路径都以某个源目录开头：源目录的绝对路径只求一次，每个文件只替换前缀 (os.path.abspath 每次约 6 us)
+        self._roots = [(os.path.join(os.fspath(source_dir), ''), os.path.join(os.path.abspath(source_dir), ''))
+                       for source_dir in source_dirs]
+        # 感知哈希按批写入，每批一个事务：WAL + synchronous=NORMAL 下提交只追加日志、不逐次 fsync；
+        # 缓存丢失最后几批只会导致下次重新计算
+        self._conn.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS features (path TEXT PRIMARY KEY, size INTEGER, mtime REAL,
+                                                 phash INTEGER, resolution INTEGER, lat REAL, lon REAL);
+            CREATE TABLE IF NOT EXISTS hashes (path TEXT, algo TEXT, size INTEGER, mtime REAL, digest TEXT,
+                                               PRIMARY KEY (path, algo));
+        """)
+
+    def close(self):
+        self._conn.close()
+
+    def _key(self, path):
+        """缓存中的路径键 (绝对路径字符串)"""
+        path = os.fspath(path)
+        for root, abs_root in self._roots:
+            if path.startswith(root):
+                return abs_root + path[len(root):]
+        return os.path.abspath(path)
+
+    def _select_under(self, sql, *params):
+        """只查询各源目录下的记录 (主键范围查询，无需全表扫描)"""
+        for _, prefix in self._roots:
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            yield from self._conn.execute(sql, (*params, prefix, upper))
+
+    def load_features(self, infos):
+        """返回大小和修改时间都未变化的文件的 {path: (phash, resolution, gps)}"""
+        wanted = {self._key(info.path): info for info in infos}
+        found = {}
+        rows = self._select_under("SELECT path, size, mtime, phash, resolution, lat, lon FROM features WHERE path >= ? AND path < ?")
+        for path, size, mtime, phash_val, resolution, lat, lon in rows:
+            info = wanted.get(path)
+            if info is not None and info.size == size and info.mtime == mtime:
+                found[info.path] = (_from_sqlite_int(phash_val), resolution, (lat, lon) if lat is not None else None)
+        return found
+
+    def store_features(self, results, infos_by_path):
+        """保存 compute_image_features_batch 的结果 [(path, phash, resolution, gps)]"""
+        rows = []
+        for file, phash_val, resolution, gps in results:
+            info = infos_by_path[file]
+            lat, lon = gps if gps is not None else (None, None)
+            rows.append((self._key(file), info.size, info.mtime, _to_sqlite_int(phash_val), resolution, lat, lon))
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def load_hashes(self, infos, algo):
+        """返回大小和修改时间都未变化的文件的 {path: 哈希} (algo 区分完整哈希和头部哈希)"""
+        wanted = {self._key(info.path): info for info in infos}
+        found = {}
+        rows = self._select_under("SELECT path, size, mtime, digest FROM hashes WHERE algo = ? AND path >= ? AND path < ?", algo)
+        for path, size, mtime, digest in rows:
+            info = wanted.get(path)
+            if info is not None and info.size == size and info.mtime == mtime:
+                found[info.path] = digest
+        return found
+
+    def store_hashes(self, hashes, infos_by_path, algo):
+        """保存 {path: 哈希}，计算失败 (None) 的不保存"""
+        rows = [(self._key(file), algo, infos_by_path[file].size, infos_by_path[file].mtime, digest)
+                for file, digest in hashes.items() if digest is not None]
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)", rows)
+
+@dataclass(slots=True)
+class DedupState:
+    """全部源目录的处理状态。只在主线程的决策循环中读写，因此不需要锁；
+    删除和备份提交到 io_executor 中执行，决策循环不等待文件操作完成"""
+    io_executor: concurrent.futures.Executor
+    file_hashes: dict = field(default_factory=dict) # {file_path: 完整哈希}，只包含可能完全重复的文件
+    seen_hashes: dict = field(default_factory=dict) # {file_hash: FileInfo} 每个内容哈希当前保留的文件
+    phash_cache: dict = field(default_factory=dict) # {file_path: phash_value 或 None (无法计算)} 存储文件的感知哈希缓存
+    resolution_cache: dict = field(default_factory=dict) # {file_path: 宽*高} 计算感知哈希时顺带记录的分辨率
+    gps_cache: dict = field(default_factory=dict) # {file_path: (lat, lon) 或 None} 存储文件的 GPS 坐标缓存
+    phash_index: PhashIndex = field(default_factory=PhashIndex) # 图片的感知哈希索引，用于相似度比较
+    removed: set = field(default_factory=set) # 已决定删除的文件 (删除可能尚未执行)
+    backups: dict = field(default_factory=dict) # {file_path: Future} 已提交的备份操作 (同一批的文件共用一个 Future)
+    pending_backups: dict = field(default_factory=dict) # {file_path: (FileInfo, name_tag)} 尚未提交的备份，凑满一批再提交
+    deletes: list = field(default_factory=list) # 已提交的删除操作 (Future 结果为是否删除成功)
+
+    def delete(self, file_info, config, reason=""):
+        """决定删除文件：立即从后续比较中排除，实际的备份和删除交给 I/O 线程池"""
+        self.removed.add(file_info.path)
+        self.phash_index.remove(file_info.path)
+        if file_info.path in self.pending_backups:
+            # 该文件的备份还在缓冲区中：先提交，删除任务才能等待它完成
+            self.flush_backups(config)
+        self.deletes.append(self.io_executor.submit(_delete_after_backup, self.backups.get(file_info.path),
+                                                    file_info.path, config, reason, file_info.mtime))
+
+    def backup(self, file_info, config, name_tag=None):
+        """登记非重复文件的备份操作，每 IO_BATCH_SIZE 个文件作为一个任务提交"""
+        self.pending_backups[file_info.path] = (file_info, name_tag)
+        if len(self.pending_backups) >= IO_BATCH_SIZE:
+            self.flush_backups(config)
+
+    def flush_backups(self, config):
+        """把缓冲区中的备份作为一个任务提交到 I/O 线程池"""
+        if not self.pending_backups:
+            return
+        batch = list(self.pending_backups.values())
+        self.pending_backups.clear()
+        future = self.io_executor.submit(_backup_batch, batch, config)
+        for file_info, _ in batch:
+            self.backups[file_info.path] = future
+
+def _backup_batch(batch, config):
+    """在 I/O 线程中依次备份一批文件 [(FileInfo, name_tag)]，单个文件失败不影响同批其他文件"""
+    for file_info, name_tag in batch:
+        try:
+            backup_file(file_info.path, config, file_mtime=file_info.mtime, name_tag=name_tag)
+        except Exception as e:
+            logging.error("❌ 备份文件失败: %s，原因: %s", file_info.path, e)
+
+def _delete_after_backup(pending_backup, file_path, config, reason, file_mtime):
+    """先等待同一文件此前提交的备份完成，再执行删除，避免复制过程中文件被删除
+    (备份先于删除提交，线程池按提交顺序取任务，不会互相等待造成死锁)"""
+    if pending_backup is not None:
+        concurrent.futures.wait([pending_backup])
+    return safe_delete_file(file_path, config, reason=reason, file_mtime=file_mtime)
+
+# ===== 核心文件处理函数 (在主线程中按扫描顺序运行) =====
+def process_file(file_info, config, state):
+    """判断单个文件是否完全重复或相似，并决定删除/备份 (file_info 为扫描阶段缓存的 FileInfo)；
+    返回 1 表示决定删除当前文件，否则返回 0"""
+    file = file_info.path
+
+    # 当前文件可能已作为其他文件的相似对象被决定删除
+    if file in state.removed:
+        logging.debug("文件 %s 已被删除，跳过处理。", file)
         return 0
 
     try:
-        # 检查文件大小
-        file_size = file.stat().st_size
-        min_size_bytes = args.min_size * 1024
-        if file_size < min_size_bytes:
-             logging.debug(f"文件 {file} 小于最小扫描大小 ({args.min_size} KB)，跳过。")
-             return 0
-
-        # 检查文件扩展名是否在允许范围内
-        # 注意：process_directory 已经过滤了一次，但这里可以作为二次确认或针对特定处理步骤的过滤
-        if file.suffix.lower() not in IMAGE_EXTENSIONS:
-             logging.debug(f"文件 {file} 扩展名不在允许范围 {IMAGE_EXTENSIONS} 内，跳过。")
-             # 对于非允许扩展名的文件，不进行任何处理（不删除也不备份）
-             return 0
-
-
-        # 1. 计算文件哈希并检查完全重复文件
-        file_hash_val = file_hash(file)
-        if file_hash_val is None:
-             logging.error(f"❌ 无法计算哈希，跳过文件: {file}")
-             return 0 # 哈希计算失败，无法进行任何处理
-
-        is_exact_duplicate = False
-        original_exact_file = None
-        with seen_hashes_lock:
-            if file_hash_val in seen_hashes:
-                original_exact_file = seen_hashes[file_hash_val]
-                is_exact_duplicate = True
+        # 扩展名和最小大小已在扫描时一次过滤 (小写文件名只计算一次)，这里不再逐个文件重复检查
+        file_size = file_info.size
+
+        # 1. 检查完全重复文件
+        # 只有大小和开头 64 KB 都与其他文件相同的文件才可能完全重复，它们的完整哈希已预先算好，其余文件没有哈希
+        file_hash_val = None
+        if file in state.file_hashes:
+            file_hash_val = state.file_hashes[file]
+            if file_hash_val is None:
+                 logging.error("❌ 无法计算哈希，跳过文件: %s", file)
+                 return 0 # 哈希计算失败，无法进行任何处理
+
+            original_exact_info = state.seen_hashes.get(file_hash_val)
+            if original_exact_info is None or original_exact_info.path in state.removed:
+                # 第一次见到此哈希 (或之前保留的文件已被删除)，由当前文件代表该哈希
+                state.seen_hashes[file_hash_val] = file_info
             else:
-                # 如果不是完全重复文件（基于内容哈希第一次见），将其哈希添加到 seen_hashes 中
-                seen_hashes[file_hash_val] = file
-
-        if is_exact_duplicate:
-            # 找到了完全重复文件
-            # original_exact_file 是 seen_hashes 中记录的第一个拥有此哈希的文件路径
-            if original_exact_file.exists() and file != original_exact_file:
-                 # 处理完全重复对，并检查当前文件是否被删除
-                 # handle_exact_duplicate 返回 True 如果当前文件被删除
-                 file_was_deleted = handle_exact_duplicate(file, original_exact_file, args, source_dir_arg)
-                 if file_was_deleted:
-                     return 1 # 当前文件被删除了
-                 else:
-                     # 如果当前文件因为 GPS 等规则被保留了 (原文件被删除)
-                     # 理论上它现在是 seen_hashes 中这个哈希对应的更好的文件，但我们不修改 seen_hashes 以简化并发逻辑
-                     # 这种情况下当前文件未被删除
-                     return 0
-            elif file == original_exact_file:
-                 # 文件路径完全相同，这是同一个文件，不处理
-                 logging.debug(f"文件 {file} 是自身引用，跳过重复检查。")
-                 return 0
-            else:
-                 # original_exact_file 不存在 (可能已被其他线程处理并删除)，那么当前文件也是重复的，但没有原件可以比对。
-                 # 这里选择跳过处理当前文件，认为它可能已被其他逻辑处理或不应处理。
-                 logging.debug(f"文件 {file} 是哈希重复文件，但原文件 {original_exact_file} 不存在，跳过删除。")
-                 return 0 # 未删除当前文件
-
-        # 3. 如果不是完全重复，检查相似图片 (仅对图片且启用相似度检查和去重时)
+                # 找到了完全重复文件，handle_exact_duplicate 返回 True 如果当前文件被删除
+                if handle_exact_duplicate(file_info, original_exact_info, config, state):
+                    return 1 # 当前文件被删除了
+                # 当前文件因为 GPS 等规则被保留 (原文件被删除)，由当前文件代表该哈希
+                if original_exact_info.path in state.removed:
+                    state.seen_hashes[file_hash_val] = file_info
+                return 0
+
+        # 2. 如果不是完全重复，检查相似图片 (仅对图片且启用相似度检查和去重时)
         # 注意：视频文件不参与相似度检查
-        is_img = is_image_file(file)
-        # is_video 标志在上方已获取
-        can_do_similarity = is_img and args.include_similar and args.deduplicate
-
-        file_was_deleted_as_similar = False # 标记当前文件是否因相似而被删除
-
-        if can_do_similarity:
-            # 文件是图片，并且启用了相似度检查和去重
-            file_phash = calculate_phash(file, phash_cache, phash_cache_lock)
+        if config.include_similar and config.deduplicate:
+            # 感知哈希通常已在预计算阶段算好；不是图片时为 None
+            file_phash = calculate_phash(file, state.phash_cache, state.resolution_cache)
 
             if file_phash is not None:
-                # 成功计算出感知哈希
-                found_similar = False
-                with phash_list_lock:
-                    # 遍历 phash_list 的副本，避免在迭代时修改同一个列表
-                    for original_file, original_phash in list(phash_list):
-                         # 检查原文件是否存在且感知哈希有效，并且相似度在阈值内
-                         if original_phash is not None and original_file.exists() and abs(file_phash - original_phash) <= args.hash_threshold:
-                            found_similar = True
-                            logging.debug(f"相似文件 {file} 与 {original_file} 匹配，进行处理...")
-
-                            # 处理相似对，并检查当前文件是否被删除
-                            # handle_similar_images 返回 True 如果当前文件被删除，False 如果原文件被删除
-                            # handle_similar_images 会负责在锁内更新 phash_list
-                            file_was_deleted_as_similar = handle_similar_images(file, original_file, file_phash, original_phash, args, source_dir_arg, phash_list, phash_list_lock)
-
-                            # 找到了相似匹配并处理了，退出相似列表的检查循环
-                            break
-
-                # 在检查完 phash_list 后
-                if not found_similar:
-                    # 如果没有在 phash_list 中找到相似文件
-                    # 将当前文件的感知哈希添加到 phash_list 供后续文件比较
-                    # 确保是图片且当前文件没有被删除（file_was_deleted_as_similar 为 False）
-                    # is_img, args.include_similar, args.deduplicate 此时应为 True
-                    with phash_list_lock: # 获取锁来修改 phash_list
-                        # 再次检查文件路径是否已经以某种方式被添加到 phash_list（例如被 handle_similar_images 添加）
-                        # 尽管 handle_similar_images 应该只在原文件被删除时才添加当前文件，这里多一层检查更保险
-                        if not any(f == file for f, _ in phash_list):
-                             phash_list.append((file, file_phash))
-
-                # 注意： file_was_deleted_as_similar 标志在 handle_similar_images 中设置
-
-            # --- 这个 elif 处理 can_do_similarity 为 True 但 file_phash 计算失败的情况 ---
-            # 它应该与 `if file_phash is not None:` 对齐
-            elif is_img: # 此时 can_do_similarity 必为 True
-                 logging.warning(f"⚠️ 跳过文件 {file} 的相似性检查，因为感知哈希计算失败。")
-                 # 感知哈希计算失败，文件没有因为相似被删除， file_was_deleted_as_similar 保持 False
-                 file_was_deleted_as_similar = False # 明确设置，尽管默认是 False
-
-        # --- 这个 else 处理 can_do_similarity 为 False 的情况 ---
-        # 它应该与 `if can_do_similarity:` 对齐
-        else:
-            # 文件不参与相似度比较 (例如：视频文件，或者没有启用相似度检查，或者没有启用去重)
-            # 文件没有因为相似被删除， file_was_deleted_as_similar 保持 False
-            file_was_deleted_as_similar = False # 明确设置，尽管默认是 False
-
-
-        # 4. 根据前面的检查结果，决定最终操作 (备份或跳过备份)
-        # 如果文件因为精确重复或相似被删除，相应的处理函数已经完成了删除操作并返回了删除标志
-        # 如果 file_was_deleted_as_similar 为 True，说明当前文件在相似度检查阶段被删除了
-        if file_was_deleted_as_similar:
-             # 当前文件因为相似而被删除了
-             return 1 # 返回删除计数 1
-        # 如果文件没有被删除 (精确重复时被保留，或者不是重复/相似文件，或者相似时被保留)
+                # 查询阈值内的候选 (返回新列表，处理过程中修改索引不影响遍历)；
+                # 当前文件是否存在只在有候选时检查一次，循环内只 stat 候选文件
+                candidates = state.phash_index.find(file_phash, config.hash_threshold)
+                if candidates and not file.exists():
+                    logging.debug("相似文件 %s 不存在，跳过相似性比较处理。", file)
+                    candidates = ()
+                for original_info, _ in candidates:
+                    original_file = original_info.path
+                    if original_file != file and original_file.exists():
+                        logging.debug("相似文件 %s 与 %s 匹配，进行处理...", file, original_file)
+                        # 处理相似对，handle_similar_images 返回 True 如果当前文件被删除，False 如果原文件被删除
+                        if handle_similar_images(file_info, original_info, config, state):
+                            return 1 # 当前文件因为相似而被删除了
+                        # 找到了相似匹配并处理了，退出相似列表的检查循环
+                        break
+
+                # 当前文件未被删除 (没有相似文件，或相似时被保留)，加入索引供后续文件比较
+                state.phash_index.add(file_info, file_phash)
+
+            elif is_image_file(file):
+                 logging.warning("⚠️ 跳过文件 %s 的相似性检查，因为感知哈希计算失败。", file)
+
+        # 3. 文件没有被删除 (不是重复/相似文件，或相似时被保留)
         # 并且没有设置 --deduplicate-only (即需要备份非重复文件)
-        elif not args.deduplicate_only:
-            # 备份该文件
-            backup_file(file, args.perform_actions, Path(args.backup_dir), args.source_dir, args.simple_backup, args.simple_backup_path, overwrite_files=args.overwrite)
-            # 文件未被删除
-            return 0
-        else: # 文件未被删除，但设置了 --deduplicate-only
-            # 不备份非重复文件
-            return 0 # 文件未被删除
+        if not config.deduplicate_only:
+            # 备份该文件；已有内容哈希时直接复用，其余文件用 大小_修改时间 作为文件名标识，避免再读一遍文件
+            name_tag = file_hash_val[:8] if file_hash_val else f"{file_size}_{int(file_info.mtime)}"
+            state.backup(file_info, config, name_tag=name_tag)
+        return 0
 
 
     except Exception as e:
-         logging.error(f"❌ 处理文件 {file} 时发生未知错误: {e}", exc_info=True)
+         logging.error("❌ 处理文件 %s 时发生未知错误: %s", file, e, exc_info=True)
          return 0 # 发生错误，未删除文件
 
 # ... (您的其余代码，包括 process_directory 和 parse_args 保持不变) ...
 
 # ===== 目录扫描和处理函数 =====
 # ===== 目录扫描和处理函数 =====
-def process_directory(args, source_dir):
-    """扫描目录并处理文件"""
-    global interrupted # <--- 添加这一行
+def _dirs_overlap(dir_a, dir_b):
+    """两个目录是否相同或其中一个位于另一个之下 (按解析符号链接后的真实路径判断)"""
+    real_a, real_b = dir_a.resolve(), dir_b.resolve()
+    return real_a == real_b or real_a in real_b.parents or real_b in real_a.parents
 
-    # 使用线程安全的字典和列表，并使用锁进行同步
-    seen_hashes = {} # {file_hash: first_file_path} 存储文件哈希和第一次遇到的文件路径
-    phash_cache = {} # {file_path: phash_value} 存储文件的感知哈希缓存
-    phash_list = []  # [(file_path, phash_value)] 存储图片的感知哈希列表，用于相似度比较
+def _logged_scan(source_dir):
+    """记录开始扫描的目录，再产出其中的文件 (多个源目录依次扫描时按目录记录)"""
+    logging.info(f"🔍 扫描目录: {source_dir}")
+    return iter_files(source_dir)
+
+def process_directory(args, source_dirs, config):
+    """扫描全部源目录并作为一个整体处理文件：跨目录的重复/相似文件同样能被发现，
+    靠前的源目录中的文件先处理，优先作为保留的原文件"""
+    global interrupted # <--- 添加这一行
+    config = replace(config, source_dirs=tuple(source_dirs))
 
-    # 创建锁对象
-    seen_hashes_lock = threading.Lock()
-    phash_cache_lock = threading.Lock()
-    phash_list_lock = threading.Lock()
+    # 所有缓存和索引只由主线程读写；删除和备份操作在 I/O 线程池中执行
+    io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.threads)
+    state = DedupState(io_executor)
 
 
     # 过滤文件
-    logging.info(f"🔍 扫描目录: {source_dir}")
-    all_files = []
-    for f in source_dir.rglob('*'):
-        if interrupted:
-             logging.info("🛑 扫描目录时收到中断信号，停止扫描。")
-             break
-        if f.is_file():
-            try:
-                # 检查文件大小和扩展名
-                min_size_bytes = args.min_size * 1024
-                # 只有大小符合且扩展名符合的文件才加入待处理列表
-                if f.stat().st_size >= min_size_bytes and f.suffix.lower() in IMAGE_EXTENSIONS:
-                     # 检查写权限，如果不能写，通常也不能删除或移动
-                     if os.access(f, os.W_OK):
-                         all_files.append(f)
-                     else:
-                         logging.warning(f"⚠️ 文件无写入权限，跳过: {f}")
-                # else: 文件大小不符合或扩展名不符合，跳过
-
-            except FileNotFoundError:
-                logging.debug(f"扫描时文件未找到: {f}") # 可能是文件被删除，正常情况
-            except OSError as e:
-                 logging.error(f"❌ 扫描文件时发生 OS 错误: {f}，原因: {e}")
-            except Exception as e:
-                 logging.error(f"❌ 扫描文件时发生未知错误: {f}，原因: {e}")
+    all_files = [] # [FileInfo]，每个文件只 stat 一次，后续流程复用
+    min_size_bytes = config.min_size_bytes
+    for entry in itertools.chain.from_iterable(map(_logged_scan, source_dirs)):
+        try:
+            # 先按扩展名过滤：Linux 上 scandir 只带回 d_type，DirEntry.stat 首次调用仍会发起一次 stat 系统调用，
+            # 非图片文件无需为其付出这次调用 (结果随后由 DirEntry 缓存)
+            # 只把最后一个点之后的扩展名转为小写再查 frozenset，不复制、转换整个文件名；
+            # 规则与 os.path.splitext 一致 (开头的点不算扩展名分隔符，如 '.jpg' 这样的隐藏文件没有扩展名)
+            name = entry.name
+            dot = name.rfind('.')
+            if dot <= 0 or name[dot:].lower() not in IMAGE_EXTENSIONS or not name[:dot].lstrip('.'):
+                continue
+            st = entry.stat(follow_symlinks=False)
+            # 只有大小符合的文件才加入待处理列表
+            # 不再逐个文件用 os.access 预检查写权限：这类文件很少，删除失败时由 safe_delete_file 记录并保留文件
+            # (能否删除取决于所在目录的写权限，而不是文件本身的，预检查本来也不准确)
+            if st.st_size >= min_size_bytes:
+                # Path 对象只为通过过滤的文件构造：解析路径每个约 2 us，比 stat 本身还贵
+                all_files.append(FileInfo(Path(entry.path), st.st_size, st.st_mtime))
+            # else: 文件大小不符合，跳过
+
+        except FileNotFoundError:
+            logging.debug("扫描时文件未找到: %s", entry.path) # 可能是文件被删除，正常情况
+        except OSError as e:
+             logging.error("❌ 扫描文件时发生 OS 错误: %s，原因: %s", entry.path, e)
+        except Exception as e:
+             logging.error("❌ 扫描文件时发生未知错误: %s，原因: %s", entry.path, e)
+    if interrupted:
+         logging.info("🛑 扫描目录时收到中断信号，停止扫描。")
 
 
     scanned_count = len(all_files)
-    # deleted_count 和 retained_count 在处理循环中累加或在最后计算
-    # deleted_count = 0
-    # retained_count = 0
-
-    logging.info(f"共找到 {scanned_count} 个符合条件的文件 (最小大小: {args.min_size} KB, 包含视频: {args.include_videos})")
-
-    # 如果需要检测相似图片并去重，预先计算感知哈希
-    # 只有当 --include-similar 和 --deduplicate 同时启用时才进行phash计算
-    if args.include_similar and args.deduplicate:
-        logging.info("\t🎨 预先计算感知哈希...")
-        # 可以使用线程池加速 phash 计算
-        with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
-            # 使用 partial 将锁和其他不变参数传递给 calculate_phash
-            from functools import partial
-            # 只有是图片的文件才需要计算 phash
-            image_files_for_phash = [f for f in all_files if is_image_file(f)]
-            futures = {executor.submit(calculate_phash_partial, file): file for file in image_files_for_phash}
-
-            processed_phash_count = 0
-            total_image_files = len(image_files_for_phash)
-            print(f"\t🎨 感知哈希计算进度: 0/{total_image_files}", end="", flush=True) # 初始化进度条
-
-            for future in concurrent.futures.as_completed(futures):
-                if interrupted:
-                     print("\n🛑 预计算感知哈希时收到中断信号。正在尝试关闭线程...")
-                     executor.shutdown(wait=False, cancel_futures=True) # 尝试取消剩余任务并立即返回
-                     break # 退出结果收集循环
-                file = futures[future]
-                try:
-                    # Get result to catch exceptions in worker threads
-                    future.result()
-                    processed_phash_count += 1
-                    print(f"\t\r🎨 感知哈希计算进度: {processed_phash_count}/{total_image_files}", end="", flush=True)
-                except Exception as e:
-                    logging.error(f"❌ 预计算文件 {file} 的感知哈希失败: {e}")
-
-            # 如果没有中断，打印完成信息
-            if not interrupted:
-                 print("\n\t✅ 感知哈希计算完成.")
+    infos_by_path = {info.path: info for info in all_files}
+
+    # 特征缓存、进程池和转发子进程日志的监听线程都在头部/完整哈希阶段之前打开：登记到 feature_resources，
+    # 这期间任何异常 (如缓存写入、哈希计算失败) 都会取消排队中的任务、关闭进程池、停止监听线程并关闭缓存连接
+    with contextlib.ExitStack() as feature_resources:
+        # 打开持久化特征缓存 (--no-cache 时不使用)
+        feature_cache = None
+        if not args.no_cache:
+            try:
+                feature_cache = FeatureCache(config.backup_dir / FEATURE_CACHE_FILE, source_dirs)
+            except sqlite3.Error as e:
+                logging.warning(f"⚠️ 无法打开特征缓存 {config.backup_dir / FEATURE_CACHE_FILE}，本次不使用缓存。原因: {e}")
             else:
-                 print("\n\t⚠️ 感知哈希计算被中断.")
-
-        # 构建初始的 phash_list，只包含成功计算出 phash 的图片文件
-        with phash_cache_lock: # 获取锁来安全访问 phash_cache
-             # 过滤掉 phash 为 None 的项
-             phash_list[:] = [(f, h) for f, h in phash_cache.items() if h is not None]
-        logging.info(f"✨ 完成感知哈希预计算，共获取到 {len(phash_list)} 个文件的感知哈希用于相似度比较。")
+                feature_resources.callback(feature_cache.close)
+        # 按大小分组计数：只有大小相同的文件才可能完全重复，需要计算内容哈希
+        size_counts = Counter(info.size for info in all_files)
+
+        # 只有当 --include-similar 和 --deduplicate 同时启用时才需要感知哈希；上次运行已缓存且未变化的文件直接使用缓存结果
+        need_features = args.include_similar and args.deduplicate
+        cached_features = feature_cache.load_features(all_files) if need_features and feature_cache is not None else {}
+        feature_executor = None
+        phash_futures = {} # {Future: batch} 已提交的感知哈希任务
+        if need_features and not interrupted:
+            logging.info("\t🎨 预先计算感知哈希...")
+            # phash (解码 + DCT) 是 CPU 密集型任务，使用进程池绕开 GIL，进程数按可用 CPU 数而不是 I/O 线程数
+            feature_workers = available_cpus()
+            # Pillow 首次 Image.open 时才导入 JPEG/PNG 等格式插件 (约 8 ms)；在主进程中先导入，fork 出的子进程不必各自再导入一遍
+            Image.preinit()
+            worker_log_queue, worker_log_listener = start_worker_log_forwarding()
+            feature_resources.callback(worker_log_listener.stop) # 后登记的先执行：先关闭进程池，再停止监听线程
+            feature_executor = concurrent.futures.ProcessPoolExecutor(max_workers=feature_workers, initializer=_init_feature_worker,
+                                                                      initargs=(worker_log_queue,))
+            # 正常流程中进程池由下面的 with 在结果全部收集后关闭，这里的关闭届时不再有任何作用
+            feature_resources.callback(feature_executor.shutdown, wait=True, cancel_futures=True)
+            # 大小唯一的文件不可能与其他文件完全重复，它们的感知哈希不依赖内容哈希的结果：扫描结束就提交，
+            # 子进程的解码与下面以磁盘读取为主的头部/完整哈希阶段重叠进行，不必等全部哈希算完才开始
+            # (在创建哈希线程池之前提交，进程池 fork 子进程时主进程中还没有工作线程)
+            phash_futures.update(submit_feature_batches(
+                feature_executor, [info.path for info in all_files if size_counts[info.size] == 1 and info.path not in cached_features
+                                   and info.path.suffix.lower() in STILL_IMAGE_EXTENSIONS], feature_workers))
+
+        # 大小相同的文件再比较开头 64 KB 的哈希，开头也相同的才需要计算整文件哈希
+        same_size_files = [info for info in all_files if size_counts[info.size] > 1]
+        # 头部哈希同样按 (大小, 修改时间) 缓存，以单独的算法名保存，再次运行时无需重新打开这些文件
+        head_algo = f"{config.hash_algo}:head{HEAD_HASH_BYTES // 1024}k"
+        cached_heads = feature_cache.load_hashes(same_size_files, head_algo) if feature_cache is not None and same_size_files else {}
+        heads_to_compute = [info.path for info in same_size_files if info.path not in cached_heads]
+        # 每个文件只读 64 KB，单个任务很短：按 FEATURE_BATCH_SIZE 个文件一批提交，避免每个文件一个 Future 的调度开销
+        head_batches = [heads_to_compute[i:i + FEATURE_BATCH_SIZE] for i in range(0, len(heads_to_compute), FEATURE_BATCH_SIZE)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
+            futures = [executor.submit(_head_hash_batch, batch, config.hash_algo) for batch in head_batches]
+            new_heads = dict(zip(heads_to_compute, itertools.chain.from_iterable(results_until_interrupted(executor, futures))))
+        if feature_cache is not None and new_heads:
+            feature_cache.store_hashes(new_heads, infos_by_path, head_algo)
+        # 中断后未计算的头部哈希按失败 (None) 处理，之后的阶段在中断时都会跳过
+        head_hashes = [cached_heads[info.path] if info.path in cached_heads else new_heads.get(info.path) for info in same_size_files]
+        head_counts = Counter(zip((info.size for info in same_size_files), head_hashes))
+        # 头部哈希失败的文件保守地交给整文件哈希处理
+        full_hash_candidates = {info.path for info, head in zip(same_size_files, head_hashes)
+                                if head is None or head_counts[(info.size, head)] > 1}
+        logging.info(f"大小相同的文件 {len(same_size_files)} 个，其中开头内容也相同、需要计算完整哈希的 {len(full_hash_candidates)} 个")
+        # 不超过 64 KB 的文件，头部哈希就是完整哈希，直接复用
+        for info, head in zip(same_size_files, head_hashes):
+            if head is not None and info.size <= HEAD_HASH_BYTES and info.path in full_hash_candidates:
+                state.file_hashes[info.path] = head
+        # 其余候选优先使用上次运行缓存的哈希，剩下的一次性并行算好 (见 plan_hash_chunks)，处理阶段只查表；
+        # 候选只可能来自大小相同的文件 (顺序与 all_files 一致)，不必再遍历全部扫描结果
+        candidate_infos = [info for info in same_size_files if info.path in full_hash_candidates]
+        if feature_cache is not None and candidate_infos:
+            # 只查询候选：之前运行中留下的非候选文件的哈希不读入，否则这些文件的备份文件名会随缓存状态变化
+            state.file_hashes.update(feature_cache.load_hashes(candidate_infos, config.hash_algo))
+        remaining = [info for info in candidate_infos if info.path not in state.file_hashes]
+
+        # 每个 (大小, 头部哈希) 组按扫描顺序的第一个文件一定是其内容哈希的代表，之后还要计算感知哈希；
+        # 这些图片在计算完整哈希时从同一次读取中顺带算好特征，预计算阶段不必再从磁盘读一遍
+        fused_paths = set()
+        if need_features and remaining:
+            seen_heads = set()
+            for info, head in zip(same_size_files, head_hashes):
+                if head is None or info.path not in full_hash_candidates or (info.size, head) in seen_heads:
+                    continue
+                seen_heads.add((info.size, head))
+                if (info.path not in state.file_hashes and info.path not in cached_features
+                        and info.path.suffix.lower() in STILL_IMAGE_EXTENSIONS):
+                    fused_paths.add(info.path)
+        fused_features = []
+        if remaining and not interrupted:
+            new_hashes, fused_features = compute_file_hashes(remaining, args.pool, source_dirs, args.threads,
+                                                             config.hash_algo, feature_paths=fused_paths)
+            state.file_hashes.update(new_hashes)
+            if feature_cache is not None:
+                feature_cache.store_hashes(new_hashes, infos_by_path, config.hash_algo)
+                if fused_features:
+                    feature_cache.store_features(fused_features, infos_by_path)
+        # deleted_count 和 retained_count 在处理循环中累加或在最后计算
+        # deleted_count = 0
+        # retained_count = 0
+
+        logging.info(f"共找到 {scanned_count} 个符合条件的文件 (最小大小: {args.min_size} KB, 包含视频: {args.include_videos})")
+
+        # 如果需要检测相似图片并去重，收集预先计算的感知哈希 (大小唯一的文件已在扫描后提交)；
+        # 中断时同样在这里取消排队中的任务并关闭进程池
+        if feature_executor is not None:
+            with feature_executor as executor:
+                if cached_features:
+                    logging.info(f"♻️ 从特征缓存中读取到 {len(cached_features)} 个文件的感知哈希/GPS 信息")
+                if fused_features:
+                    logging.info(f"计算完整哈希时已顺带得到 {len(fused_features)} 个文件的感知哈希/GPS 信息")
+                # 无法计算的 (None) 也记入缓存，处理阶段不再在主线程中重新解码
+                for file, (phash_val, resolution, gps) in itertools.chain(
+                        cached_features.items(), ((file, rest) for file, *rest in fused_features)):
+                    state.phash_cache[file] = phash_val
+                    if phash_val is not None:
+                        state.resolution_cache[file] = resolution
+                    state.gps_cache[file] = gps
+
+                # 与前面某个文件内容完全相同的文件在处理阶段只走完全重复分支，不需要感知哈希；
+                # 少数因代表文件已被删除而进入相似性检查的，由 calculate_phash 按需计算
+                seen_full_hashes = set()
+                exact_dup_paths = set()
+                for info in all_files:
+                    full_hash = state.file_hashes.get(info.path)
+                    if full_hash is None:
+                        continue
+                    if full_hash in seen_full_hashes:
+                        exact_dup_paths.add(info.path)
+                    else:
+                        seen_full_hashes.add(full_hash)
+
+                # 图片有效性由子进程在计算 phash 时判断，主进程不再逐个打开文件预检查；
+                # 视频没有感知哈希，不再送入进程池 (否则子进程还要对每个视频做一次无用的 EXIF 解析)，
+                # 完全重复的视频需要的 GPS 由之后的 GPS 阶段读取
+                # 大小唯一的文件已经提交，这里只剩大小相同、且不是完全重复副本的文件
+                image_files_for_phash = [info.path for info in same_size_files if info.path not in cached_features
+                                         and info.path not in exact_dup_paths and info.path not in state.phash_cache
+                                         and info.path.suffix.lower() in STILL_IMAGE_EXTENSIONS]
+                if exact_dup_paths:
+                    logging.info(f"跳过 {len(exact_dup_paths)} 个完全重复文件的感知哈希计算")
+                futures = phash_futures
+                futures.update(submit_feature_batches(executor, image_files_for_phash, feature_workers))
+
+                processed_phash_count = 0
+                total_image_files = sum(map(len, futures.values()))
+                print(f"\t🎨 感知哈希计算进度: 0/{total_image_files}", end="", flush=True) # 初始化进度条
+                next_phash_progress = 0.0
+
+                for future in concurrent.futures.as_completed(futures):
+                    if interrupted:
+                         print("\n🛑 预计算感知哈希时收到中断信号。正在尝试关闭进程池...")
+                         # 取消排队中的任务，只等待正在执行的批次 (wait=False 时随后 with 退出的 shutdown() 会重置取消标记)
+                         executor.shutdown(wait=True, cancel_futures=True)
+                         break # 退出结果收集循环
+                    batch = futures[future]
+                    try:
+                        # 子进程返回结果，由主进程写入缓存
+                        results = future.result()
+                    except Exception as e:
+                        logging.error(f"❌ 预计算 {len(batch)} 个文件的感知哈希失败 (首个文件: {batch[0]}): {e}")
+                        results = []
+                    for file, phash_val, resolution, gps in results:
+                        # 无法计算的 (None) 也记入缓存，失败原因已由子进程记录，处理阶段不再重新解码
+                        state.phash_cache[file] = phash_val
+                        if phash_val is not None:
+                            state.resolution_cache[file] = resolution
+                        state.gps_cache[file] = gps
+                    if feature_cache is not None and results:
+                        feature_cache.store_features(results, infos_by_path)
+                    processed_phash_count += len(batch)
+                    # 与处理阶段相同按时间节流，最后一批总会输出
+                    now = time.monotonic()
+                    if now >= next_phash_progress or processed_phash_count == total_image_files:
+                        next_phash_progress = now + PROGRESS_INTERVAL
+                        print(f"\t\r🎨 感知哈希计算进度: {processed_phash_count}/{total_image_files}", end="", flush=True)
+
+                # 如果没有中断，打印完成信息
+                if not interrupted:
+                     print("\n\t✅ 感知哈希计算完成.")
+                else:
+                     print("\n\t⚠️ 感知哈希计算被中断.")
+
+            # phash_index 不预先填充：决策循环按扫描顺序处理，每个文件只与之前保留下来的文件比较
+            phash_count = sum(1 for phash_val in state.phash_cache.values() if phash_val is not None)
+            logging.info(f"✨ 完成感知哈希预计算，共获取到 {phash_count} 个文件的感知哈希用于相似度比较。")
+
+    # 完全重复的文件在处理阶段要比较双方的 GPS；预计算未覆盖的 (未启用相似检查，或跳过了感知哈希的重复副本)
+    # 先用线程池并行读取 EXIF，决策循环中只查表
+    hash_group_sizes = Counter(h for h in state.file_hashes.values() if h is not None)
+    gps_needed = [file for file, h in state.file_hashes.items()
+                  if h is not None and hash_group_sizes[h] > 1 and file not in state.gps_cache]
+    if gps_needed and not interrupted:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
+            futures = [executor.submit(get_gps_coordinates, file) for file in gps_needed]
+            state.gps_cache.update(zip(gps_needed, results_until_interrupted(executor, futures)))
 
 
-    # 使用线程池处理文件去重和备份
-    logging.info(f"🚀 开始处理文件 ({args.threads} 线程)...")
+    # 主线程按扫描顺序逐个决策 (结果与线程调度无关)，删除和备份在 I/O 线程池中执行
+    logging.info(f"🚀 开始处理文件 ({args.threads} 个 I/O 线程)...")
     processed_count = 0
-    deleted_in_processing = 0 # Counter for files deleted during processing
-    # retained_in_processing = 0 # 可以在循环内计算，无需单独的计数器
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
-        # 提交所有文件进行处理
-        futures = {
-            executor.submit(process_file, file, seen_hashes, phash_cache, phash_list, args, source_dir,
-                           seen_hashes_lock, phash_cache_lock, phash_list_lock): file
-            for file in all_files
-        }
+    deleted_in_processing = 0 # 已决定删除的文件数 (包括被当前文件替换掉的原文件)
+    next_progress = 0.0
 
-        try:
-            for future in concurrent.futures.as_completed(futures):
-                if interrupted:
-                    # 如果在等待 future 完成时收到中断信号，尝试停止执行
-                    print("\n🛑 文件处理时收到中断信号。正在等待线程完成当前任务...")
-                    break # 退出结果收集循环
+    def print_progress():
+        print(f"\t\r📝 处理进度: {processed_count}/{scanned_count}, 已删除: {deleted_in_processing}, "
+              f"已保留: {processed_count - deleted_in_processing}", end="", flush=True)
 
-                file = futures[future]
+    try:
+        for file_info in all_files:
+            if interrupted:
+                print("\n🛑 文件处理时收到中断信号。正在取消尚未执行的文件操作...")
+                break
+
+            process_file(file_info, config, state)
+            processed_count += 1
+
+            # 更新进度条 (按时间节流，循环结束后再输出一次最终状态)；删除/保留数只在输出时才计算
+            now = time.monotonic()
+            if now >= next_progress:
+                next_progress = now + PROGRESS_INTERVAL
+                deleted_in_processing = len(state.removed)
+                print_progress()
+
+            # 心跳日志，每处理一定数量的文件记录一次
+            if processed_count % 100 == 0:
+                deleted_in_processing = len(state.removed)
+                logging.info("💖 心跳 - 已处理 %d/%d 个文件, 已删除 %d 个, 已保留 %d 个", processed_count, scanned_count,
+                             deleted_in_processing, processed_count - deleted_in_processing) # 日志中也加入保留数
 
-                try:
-                    # Get the result - it's the number of files deleted by this processing step (either 0 or 1)
-                    deleted_by_thread = future.result()
-                    deleted_in_processing += deleted_by_thread
-                    processed_count += 1
-
-                    # --- 在这里计算当前已处理且未被删除的文件数量 ---
-                    retained_so_far = processed_count - deleted_in_processing
-                    # --------------------------------------------------
-
-                    # 更新进度条
-                    # 将 已保留: {retained_so_far} 加入输出
-                    print(f"\t\r📝 处理进度: {processed_count}/{scanned_count}, 已删除: {deleted_in_processing}, 已保留: {retained_so_far}", end="", flush=True)
-
-                    # 心跳日志，每处理一定数量的文件记录一次
-                    if processed_count % 100 == 0:
-                        logging.info(f"💖 心跳 - 已处理 {processed_count}/{scanned_count} 个文件, 已删除 {deleted_in_processing} 个, 已保留 {retained_so_far} 个") # 日志中也加入保留数
-
-                except concurrent.futures.CancelledError:
-                     logging.debug(f"文件 {file} 的处理任务被取消。")
-                     processed_count += 1 # 仍然算作一个已处理文件 (跳过处理)
-                except Exception as e:
-                    logging.error(f"❌ 文件 {file} 的处理线程发生异常: {e}", exc_info=True)
-                    processed_count += 1 # 发生错误，仍然算作一个已处理文件 (未删除)
-
-        except KeyboardInterrupt:
-             print("\n🛑 脚本主线程捕获到中断信号。正在通知工作线程并等待退出...")
-             interrupted = True
-             pass # Allow the 'with' block to clean up
+    except KeyboardInterrupt:
+         print("\n🛑 脚本主线程捕获到中断信号。正在取消尚未执行的文件操作...")
+         interrupted = True
+    finally:
+        if not interrupted:
+            state.flush_backups(config) # 提交最后不满一批的备份 (中断时与排队中的任务一样放弃)
+        deleted_in_processing = len(state.removed)
+        print_progress()
+        # 中断时取消排队中的删除/备份 (未执行的删除不会发生，文件保持原样)，否则等待全部完成
+        io_executor.shutdown(wait=True, cancel_futures=interrupted)
 
     print("\n") # 在进度条完成后打印换行符，确保下一行输出正常
 
-    # 在所有线程完成后计算最终统计
-    deleted_count = deleted_in_processing
+    # 在所有文件操作完成后计算最终统计：只统计实际执行成功的删除
+    deleted_count = sum(1 for future in state.deletes
+                        if not future.cancelled() and future.exception() is None and future.result())
     # 保留文件总数 = 扫描的文件总数 - 实际被删除的文件总数
     retained_count = scanned_count - deleted_count
 
-    logging.info(f"✅ 目录处理完成: {source_dir}")
+    logging.info(f"✅ 目录处理完成: {', '.join(map(str, source_dirs))}")
     logging.info(f"   扫描文件总数: {scanned_count}")
     logging.info(f"   删除文件总数: {deleted_count}")
     logging.info(f"   保留文件总数: {retained_count}")
@@ -846,7 +2036,7 @@ def parse_args():
     """解析命令行参数"""
     parser = argparse.ArgumentParser(description="图片和视频去重备份脚本 (默认模拟执行)")
     parser.add_argument("source_dir", nargs='?', type=str, help="要处理的第一个图片和视频目录 (留空则提示输入)")
-    parser.add_argument("--optional-source-dir", nargs='?', type=str, help="可选的第二个图片和视频目录")
+    parser.add_argument("--optional-source-dir", nargs='?', type=str, help="可选的第二个图片和视频目录 (与第一个目录一起查重，跨目录的重复文件同样会被处理)")
     parser.add_argument("backup_dir", nargs='?', type=str, help="被删除文件的备份目录 (留空则提示输入)")
     parser.add_argument("-e", "--execute", dest='perform_actions', action="store_true", help="执行实际的删除和备份操作")
     parser.add_argument("--include-similar", action="store_true", help="启用感知哈希比对，删除相似图片")
@@ -855,7 +2045,10 @@ def parse_args():
     parser.add_argument("--trash-dir", nargs='?', type=str, help="指定软删除目录 (留空则提示输入)")
     parser.add_argument("--log-dir", nargs='?', type=str, help="指定日志文件输出目录 (留空则提示输入)")
     parser.add_argument("--hash-threshold", type=int, default=HASH_THRESHOLD, help=f"相似图片哈希值阈值 (默认: {HASH_THRESHOLD})")
+    parser.add_argument("--hash-algo", choices=HASH_ALGOS, default=HASH_ALGO, help=f"完全重复检测使用的文件哈希算法，blake3/xxh3 需要安装对应的包 (默认: {HASH_ALGO})")
     parser.add_argument("--threads", type=int, default=4, help="设置处理线程数 (默认: 4)")
+    parser.add_argument("--no-cache", action="store_true", help=f"不使用备份目录下的特征缓存 ({FEATURE_CACHE_FILE})，所有哈希重新计算")
+    parser.add_argument("--pool", choices=["thread", "process", "auto"], default="auto", help="完整哈希计算使用线程池或进程池 (auto: 全部源目录都在本地固态盘上时用进程池，否则用线程池，默认: auto)")
     parser.add_argument("--prefer-resolution", action="store_true", help="对于相似图片，优先保留分辨率更高的版本")
     parser.add_argument("-m", "--min-size", type=int, default=DEFAULT_MIN_SIZE_KB, help=f"设置最小扫描文件大小 (KB, 默认: {DEFAULT_MIN_SIZE_KB} KB)")
     parser.add_argument("-v", "--include-videos", action="store_true", help="包含视频文件进行检测 (支持 .mp4, .avi, .mov, .mkv)")
@@ -886,6 +2079,9 @@ if __name__ == "__main__":
         source_directory_2 = Path(args.optional_source_dir)
         if not source_directory_2.exists():
              print(f"❌ 错误: 可选源目录不存在: {source_directory_2}")
+        elif _dirs_overlap(source_directory_1, source_directory_2):
+             # 两个目录一起扫描：互相包含时同一文件会被扫描两次，并被当作自身的重复文件
+             print(f"⚠️ 可选源目录 {source_directory_2} 与源目录 {source_directory_1} 相同或互相包含，忽略可选源目录。")
         else:
              source_directories.append(source_directory_2)
 
@@ -894,7 +2090,7 @@ if __name__ == "__main__":
         args.backup_dir = input("\t请输入被删除文件的备份目录: ")
     backup_directory = Path(args.backup_dir)
     try:
-        backup_directory.mkdir(parents=True, exist_ok=True)
+        ensure_dir(backup_directory)
     except Exception as e:
          print(f"❌ 错误: 无法创建或访问备份目录 {backup_directory}，原因: {e}")
          sys.exit(1)
@@ -913,6 +2109,10 @@ if __name__ == "__main__":
     overwrite_files = args.overwrite
     deduplicate = args.deduplicate
     deduplicate_only = args.deduplicate_only
+    hash_algo = args.hash_algo
+    if not hash_algo_available(hash_algo):
+        print(f"⚠️ 未安装 {hash_algo} 对应的依赖包，改用 sha256。")
+        hash_algo = 'sha256'
 
     trash_dir = args.trash_dir
     if delete_soft and not trash_dir:
@@ -920,7 +2120,7 @@ if __name__ == "__main__":
     trash_directory = Path(trash_dir) if trash_dir else None
     if delete_soft and trash_directory and not trash_directory.exists():
          try:
-             trash_directory.mkdir(parents=True, exist_ok=True)
+             ensure_dir(trash_directory)
          except Exception as e:
               print(f"❌ 错误: 无法创建或访问软删除目录 {trash_directory}，原因: {e}")
               # 如果软删除目录无法创建，禁用软删除
@@ -929,6 +2129,25 @@ if __name__ == "__main__":
               trash_directory = None
 
 
+    # 构建一次运行配置，后续处理函数只读取 config (使用上面校验/修正后的值)
+    config = DedupConfig(
+        perform_actions=perform_actions,
+        backup_dir=backup_directory,
+        trash_dir=trash_directory,
+        delete_soft=delete_soft,
+        enable_console_log=enable_console_log,
+        simple_backup=simple_backup,
+        simple_backup_with_path=simple_backup_with_path,
+        overwrite_files=overwrite_files,
+        deduplicate=deduplicate,
+        deduplicate_only=deduplicate_only,
+        include_similar=include_similar,
+        prefer_resolution=prefer_resolution,
+        hash_threshold=args.hash_threshold,
+        hash_algo=hash_algo,
+        min_size_bytes=min_size_kb * 1024,
+    )
+
     # --- Log file naming modification starts here ---
     log_dir = args.log_dir
     log_base_name = "photo_dedup"
@@ -964,8 +2183,11 @@ if __name__ == "__main__":
     log_file_pattern = re.compile(rf"^{re.escape(log_base_name)}(\d+)?{re.escape(log_extension)}$")
 
     try:
-        for existing_file in log_parent_dir.iterdir():
-            match = log_file_pattern.match(existing_file.name)
+        # 日志目录默认就是备份目录，可能有大量条目：只取文件名 (不为每个条目构造 Path)，前后缀都符合的才做正则匹配
+        for existing_name in os.listdir(log_parent_dir):
+            if not (existing_name.startswith(log_base_name) and existing_name.endswith(log_extension)):
+                continue
+            match = log_file_pattern.match(existing_name)
             if match:
                 # Group 1 contains the number part, if present
                 num_str = match.group(1)
@@ -974,7 +2196,7 @@ if __name__ == "__main__":
                         max_num = max(max_num, int(num_str))
                     except ValueError:
                         # Should not happen with the regex, but handle defensively
-                        logging.warning(f"⚠️ 发现异常日志文件名，无法解析编号: {existing_file.name}")
+                        logging.warning(f"⚠️ 发现异常日志文件名，无法解析编号: {existing_name}")
                 else:
                     # This matches the base name "photo_dedup.log" without a number.
                     # We can treat this as number 0 or 1, depending on desired behavior.
@@ -1008,8 +2230,13 @@ if __name__ == "__main__":
         sys.exit(1) # Exit if log directory cannot be created
 
     log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    # 日志格式只用到时间、级别和消息：不收集调用位置 (每条记录都要回溯调用栈) 和线程/进程信息
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
     # maxBytes set in bytes
-    log_handler = RotatingFileHandler(log_file_path, maxBytes=LOG_FILE_SIZE_LIMIT_MB * 1024 * 1024, backupCount=3, encoding='utf-8') # Specify encoding
+    log_handler = SizeRotatingFileHandler(log_file_path, maxBytes=LOG_FILE_SIZE_LIMIT_MB * 1024 * 1024, backupCount=3, encoding='utf-8') # Specify encoding
     log_handler.setFormatter(log_formatter)
     logger = logging.getLogger()
     # Set INFO or DEBUG level based on -log parameter, DEBUG for more detailed debug info
@@ -1017,14 +2244,18 @@ if __name__ == "__main__":
     # Clear potentially existing handlers to prevent duplicates
     if logger.hasHandlers():
         logger.handlers.clear()
-    logger.addHandler(log_handler)
+    output_handlers = [log_handler]
 
     if enable_console_log:
-        # Only add StreamHandler if console logging is enabled and no StreamHandler exists
-        if not any(isinstance(h, logging.StreamHandler) for h in logger.handlers):
-             console_handler = logging.StreamHandler(sys.stdout)
-             console_handler.setFormatter(log_formatter)
-             logger.addHandler(console_handler)
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(log_formatter)
+        output_handlers.append(console_handler)
+
+    # 工作线程只把日志记录放入队列，由后台监听线程统一写文件/控制台，避免线程在文件锁上等待
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(LocalQueueHandler(log_queue))
+    log_listener = QueueListener(log_queue, *output_handlers, respect_handler_level=True)
+    log_listener.start()
 
 
     logging.info("==== 脚本开始运行 ====")
@@ -1038,6 +2269,10 @@ if __name__ == "__main__":
         if include_similar:
             logging.info(f"相似度哈希阈值 (--hash-threshold): {args.hash_threshold}")
             logging.info(f"优先保留高分辨率 (--prefer-resolution): {prefer_resolution}")
+            # 感知哈希的耗时几乎全在 JPEG 解码上，SIMD 加速的 libjpeg-turbo 比原版 libjpeg 快数倍
+            if not PIL.features.check_feature('libjpeg_turbo'):
+                logging.warning("⚠️ 当前 Pillow 未使用 libjpeg-turbo 解码 JPEG，感知哈希计算会明显变慢；"
+                                "建议安装官方 Pillow 轮子 (已内置 libjpeg-turbo)")
     logging.info(f"最小扫描文件大小 (-m): {min_size_kb} KB")
     logging.info(f"包含视频文件 (-v): {include_videos}")
     logging.info(f"简单备份模式 (-s): {simple_backup}")
@@ -1047,6 +2282,10 @@ if __name__ == "__main__":
     if delete_soft:
         logging.info(f"回收站目录 (--trash-dir): {trash_directory}")
     logging.info(f"使用线程数 (--threads): {num_threads}")
+    logging.info(f"文件哈希算法 (--hash-algo): {hash_algo}")
+    if hash_algo == 'sha256' and cpu_has_sha_extensions() is False:
+        # 没有 SHA 指令扩展时 sha256 只有约 0.3-0.5 GB/s，完整哈希会成为查重的主要耗时
+        logging.warning("⚠️ CPU 不支持 SHA 指令扩展，sha256 较慢；大量文件查重时建议安装 blake3 并使用 --hash-algo blake3")
     logging.info(f"日志文件: {log_file_path}") # Log the actual file name being used
     logging.info(f"日志输出到控制台 (-log): {enable_console_log}")
 
@@ -1078,16 +2317,12 @@ if __name__ == "__main__":
     all_deleted_count = 0
 
     try:
-        for source_dir in source_directories:
-            source_path = Path(source_dir)
-            # 在 process_directory 中已经检查目录存在性，这里不再重复检查
-            scanned_count, retained_count, deleted_count = process_directory(
-                args=args,
-                source_dir=source_path,
-            )
-            all_scanned_count += scanned_count
-            all_retained_count += retained_count
-            all_deleted_count += deleted_count
+        # 全部源目录一次处理：共用同一份哈希/感知哈希状态和线程池，跨目录的重复文件也能被发现
+        all_scanned_count, all_retained_count, all_deleted_count = process_directory(
+            args=args,
+            source_dirs=source_directories,
+            config=config,
+        )
     except Exception as e:
          logging.critical(f"脚本主循环发生致命错误: {e}", exc_info=True)
          print(f"\n❌ 脚本运行中断，发生致命错误: {e}")
@@ -1107,3 +2342,4 @@ if __name__ == "__main__":
         print(f"\t   扫描文件总数: {all_scanned_count}")
         print(f"\t   删除文件总数: {all_deleted_count}")
         print(f"\t   保留文件总数: {all_retained_count}\n")
+        log_listener.stop() # 写出队列中剩余的日志
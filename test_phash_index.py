@@ -0,0 +1,56 @@
+"""PhashIndex 与全量比较的一致性检查 (覆盖分段表建立和尾部并入)"""
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+
+# 脚本名 test 与标准库的 test 包同名，按文件路径加载
+_spec = importlib.util.spec_from_file_location("photo_dedup", Path(__file__).with_name("test.py"))
+dedup = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(dedup)
+
+
+def _brute_force(hashes, alive, phash_int, threshold):
+    return [i for i, h in enumerate(hashes) if alive[i] and (h ^ phash_int).bit_count() <= threshold]
+
+
+def _table_misplaced(index):
+    """分段表中段取值与所在区间不符的位置数 (并入后条目必须落在自己取值的区间内)"""
+    order, starts = index._tables
+    keys = index._table_keys(0, index._indexed).reshape(dedup.MIH_CHUNKS, -1)
+    bucket_of_position = np.repeat(np.arange(len(starts) - 1), np.diff(starts))
+    return int((keys[bucket_of_position >> dedup.MIH_CHUNK_BITS, order] != bucket_of_position).sum())
+
+
+def test_find_matches_brute_force_across_tail_merges():
+    rng = np.random.default_rng(0)
+    index = dedup.PhashIndex()
+    hashes = []
+    alive = []
+    merges = 0
+    # 随机哈希的分段取值分散，查询走分段探测而不是退回全量扫描；中途删除部分条目
+    for i in range(dedup.MIH_MIN_ENTRIES + 3 * dedup.MIH_TAIL_ENTRIES):
+        value = int(rng.integers(0, 1 << 63)) << 1 | int(rng.integers(0, 2))
+        index.add(dedup.FileInfo(Path(f"{i}.jpg"), 1, 0.0), value)
+        hashes.append(value)
+        alive.append(True)
+        if i % 7 == 0:
+            victim = int(rng.integers(i + 1))
+            index.remove(Path(f"{victim}.jpg"))
+            alive[victim] = False
+        if i < dedup.MIH_MIN_ENTRIES or (i + 1) % dedup.MIH_TAIL_ENTRIES:
+            continue
+        # 依次触发建表和多次尾部并入，每次之后用已有哈希的近邻查询 (阈值 3/7 分别对应探测半径 0/1)
+        indexed = index._indexed
+        for q in range(200):
+            query = hashes[int(rng.integers(len(hashes)))] ^ (1 << int(rng.integers(64)))
+            threshold = 3 if q % 2 else 7
+            found = [int(info.path.stem) for info, _ in index.find(query, threshold)]
+            assert found == _brute_force(hashes, alive, query, threshold)
+        merges += index._indexed != indexed and indexed > 0
+        assert _table_misplaced(index) == 0
+    assert merges >= 2
+
+if __name__ == "__main__":
+    test_find_matches_brute_force_across_tail_merges()
+    print("ok")